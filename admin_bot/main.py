@@ -9,6 +9,7 @@ from telegram.ext import (
     CallbackQueryHandler
 )
 import logging
+import math
 import os
 import sys
 from os import execl
@@ -104,6 +105,13 @@ def save_currency_rates(rates):
 # --- Conversation для изменения курсов ---
 SELECT_CURRENCY, ENTER_NEW_RATE = range(100, 102)
 
+def parse_rate(text: str) -> float:
+    """Курс в рублях: '11,875' и '11.875' - это 11.875; курс никогда не пишут с разделителем тысяч"""
+    rate = float(text.replace(" ", "").replace(",", "."))
+    if not math.isfinite(rate) or rate <= 0:
+        raise ValueError(f"Invalid rate: {text}")
+    return rate
+
 def _currency_emoji(code: str) -> str:
     mapping = {
         "USD": "💵",
@@ -150,7 +158,7 @@ async def enter_new_rate(update: Update, context: CallbackContext) -> int:
         return ConversationHandler.END
     currency = context.user_data.get('currency_to_edit')
     try:
-        new_rate = float(text.replace(",", "."))
+        new_rate = parse_rate(text)
         rates = load_currency_rates()
         rates[currency] = new_rate
         save_currency_rates(rates)
@@ -1,26 +1,73 @@
+import asyncio
 import requests
-from bs4 import BeautifulSoup
-from fake_useragent import UserAgent
+import httpx
+import json
 import re
 import logging
+import time
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from site_adapters import find_adapter, remember_site
+from structured_data import extract_structured_data
+from host_scheduler import HostThrottled
+from html_backends import DEFAULT_BACKEND, as_document, parse_html, scan_document
+from http_transport import create_transport
+from price_parsing import extract_display_price, has_currency_symbol, parse_price
+from request_timing import RequestTrace
+from streaming import StreamingDetector
+from user_agents import random_user_agent
 
 logging.basicConfig(level=logging.INFO)
 
+HEAD_END = re.compile(r'</head\s*>', re.IGNORECASE)
+
+NAME_SEARCH_TAGS = ['h1', 'h2', 'h3', 'title', 'div', 'span']
+NAME_SEARCH_CLASSES = ['product-title', 'product-name', 'name', 'title']
+
+# Stages whose time a 304 revalidation saves
+PARSE_STAGES = ('html_build', 'name', 'price')
+
+# Confidence of a price by where it was found: shop JSON, structured data, page text
+PRICE_CONFIDENCE = {'adapter': 0.95, 'structured': 0.9, 'page': 0.6}
+
+def create_async_client(timeout=15, transport=None, **transport_options):
+    """Общий клиент: keep-alive пулы по хостам, HTTP/2 и кэш DNS живут в транспорте (см. create_transport)"""
+    transport = transport or create_transport(**transport_options)
+    return httpx.AsyncClient(transport=transport, timeout=timeout, follow_redirects=True)
+
 class ProductParser:
-    def __init__(self, url, timeout=15):
+    def __init__(self, url, timeout=15, backend=DEFAULT_BACKEND, snapshots=None):
         self.url = url
         self.timeout = timeout
-        self.ua = UserAgent()
-        self.headers = {'User-Agent': self.ua.random}
+        self.backend = backend
+        self.snapshots = snapshots
+        self.replaying = bool(snapshots and snapshots.replaying)
+        self._headers = None
         self.soup = None
         self.product_name = None
         self.product_price = None
+        self.price_source = None
+        self._parsed = (None, None, {})
+
+    @property
+    def headers(self):
+        # Picked on first request: parsers that only extract (benchmarks, extraction workers) never need one.
+        if self._headers is None:
+            self._headers = {'User-Agent': random_user_agent(self.url)}
+        return self._headers
 
     def fetch_page(self):
         try:
-            response = requests.get(self.url, headers=self.headers, timeout=self.timeout)
-            response.raise_for_status()
-            self.soup = BeautifulSoup(response.text, 'html.parser')
+            if self.replaying:
+                html = self.replay_page()
+            else:
+                response = requests.get(self.url, headers=self.headers, timeout=self.timeout)
+                response.raise_for_status()
+                remember_site(self.url, response.headers)
+                self.record_snapshot(self.url, response.status_code, response.headers, response.content, response.encoding)
+                html = response.text
+            self.load_html(html)
         except requests.exceptions.HTTPError as http_err:
             logging.error(f"HTTP error occurred: {http_err}")
         except requests.exceptions.Timeout:
@@ -28,21 +75,48 @@ class ProductParser:
         except Exception as err:
             logging.error(f"Other error occurred: {err}")
 
+    def load_html(self, html):
+        # Structured data usually sits in <head>: if it already has both name and
+        # price there is no need to build a tree for the whole body.
+        head_end = HEAD_END.search(html)
+        if head_end:
+            head = parse_html(html[:head_end.start()], self.backend)
+            if self._parsed_for(head)[1].keys() >= {'name', 'price'}:
+                self.soup = head
+                return
+        self.soup = parse_html(html, self.backend)
+
+    def _parsed_for(self, soup):
+        # One traversal collects name/price candidates, JSON-LD and meta tags for both parse steps.
+        if self._parsed[0] is not soup:
+            scan = scan_document(as_document(soup), NAME_SEARCH_TAGS, NAME_SEARCH_CLASSES, has_currency_symbol)
+            self._parsed = (soup, scan, extract_structured_data(scan))
+        return self._parsed[1], self._parsed[2]
+
+    def page_scan(self):
+        return self._parsed_for(self.soup)[0]
+
+    def structured_data(self):
+        return self._parsed_for(self.soup)[1] if self.soup else {}
+
     def parse_product_name(self):
         if self.soup:
-            search_tags = ['h1', 'h2', 'h3', 'title', 'div', 'span']
-            search_classes = ['product-title', 'product-name', 'name', 'title']
-            
-            for tag in search_tags:
-                product_name_tag = self.soup.find(tag)
-                if product_name_tag:
-                    self.product_name = product_name_tag.get_text(strip=True)
+            structured_name = self.structured_data().get('name')
+            if structured_name:
+                self.product_name = structured_name
+                return
+
+            scan = self.page_scan()
+            for tag in NAME_SEARCH_TAGS:
+                product_name_tag = scan.tags.get(tag)
+                if product_name_tag is not None:
+                    self.product_name = scan.text(product_name_tag)
                     return
             
-            for cls in search_classes:
-                product_name_tag = self.soup.find(class_=cls)
-                if product_name_tag:
-                    self.product_name = product_name_tag.get_text(strip=True)
+            for cls in NAME_SEARCH_CLASSES:
+                product_name_tag = scan.classes.get(cls)
+                if product_name_tag is not None:
+                    self.product_name = scan.text(product_name_tag)
                     return
 
             self.product_name = "Name not found"
@@ -52,17 +126,20 @@ class ProductParser:
 
     def parse_product_price(self):
         if self.soup:
-            currency_symbols = r'[£$€¥₹]'
-            product_price_tag = self.soup.find('span', string=lambda text: re.search(currency_symbols, text) if text else False)
-            
-            if product_price_tag:
-                price_text = product_price_tag.get_text(strip=True)
-                price_text = re.sub(r'[^\d\.,£$€¥₹]', '', price_text)
-                price_text = re.sub(r'\s+', '', price_text)
+            structured_price = self.structured_data().get('price')
+            if structured_price:
+                self.product_price = structured_price
+                self.price_source = 'structured'
+                return
 
-                numeric_price = re.search(rf'({currency_symbols}\d{{1,3}}(,\d{{3}})*(\.\d+)?|\d{{1,3}}(,\d{{3}})*(\.\d+)?\s*{currency_symbols})', price_text)
+            scan = self.page_scan()
+            product_price_tag = scan.price_node
+            
+            if product_price_tag is not None:
+                numeric_price = extract_display_price(scan.text(product_price_tag))
                 if numeric_price:
-                    self.product_price = numeric_price.group(0).strip()
+                    self.product_price = numeric_price
+                    self.price_source = 'page'
                 else:
                     self.product_price = "Price not found"
                     logging.warning("Cannot extract price.")
@@ -74,13 +151,74 @@ class ProductParser:
             logging.error("No content to parse for product price.")
 
 
+    @property
+    def recording(self):
+        return bool(self.snapshots and self.snapshots.recording)
+
+    def record_snapshot(self, url, status, headers, body, encoding):
+        if self.recording:
+            self.snapshots.save(url, status, headers, body, encoding or 'utf-8')
+
+    def load_snapshot(self, url):
+        snapshot = self.snapshots.load(url)
+        if snapshot is None:
+            raise LookupError(f"No snapshot recorded for {url}")
+        return snapshot
+
+    def replay_page(self):
+        snapshot = self.load_snapshot(self.url)
+        remember_site(self.url, snapshot.headers)
+        return snapshot.text
+
+    def fetch_json(self, url):
+        if self.replaying:
+            return json.loads(self.load_snapshot(url).text)
+        response = requests.get(url, headers=self.json_headers(), timeout=self.timeout)
+        response.raise_for_status()
+        self.record_snapshot(url, response.status_code, response.headers, response.content, response.encoding)
+        return response.json()
+
+    def fetch_adapter_data(self, adapter):
+        try:
+            data = self.fetch_json(adapter.data_url(self.url))
+            currency_url = adapter.currency_url(data, self.url)
+            if currency_url:
+                adapter.learn_currency(self.url, self.fetch_json(currency_url))
+            return adapter.parse(data, self.url)
+        except Exception as err:
+            logging.warning(f"{adapter.name} adapter failed on {self.url}: {err}")
+            return None
+
+    def json_headers(self):
+        return {**self.headers, 'Accept': 'application/json'}
+
+    def apply_product_info(self, product_info):
+        self.product_name = product_info['name']
+        self.product_price = product_info['price']
+        self.price_source = product_info.get('price_source', 'adapter')
+
+    def price_details(self):
+        """Сумма (строкой, без потери точности), код ISO 4217 и уверенность в найденной цене"""
+        parsed = parse_price(self.product_price) if self.price_source else None
+        if parsed is None:
+            return {'price_amount': None, 'price_currency': None, 'confidence': 0.0}
+        amount, currency = parsed
+        return {'price_amount': str(amount), 'price_currency': currency,
+                'confidence': PRICE_CONFIDENCE[self.price_source]}
+
     def get_product_info(self):
-        self.fetch_page()
-        self.parse_product_name()
-        self.parse_product_price()
+        adapter = find_adapter(self.url)
+        product_info = self.fetch_adapter_data(adapter) if adapter else None
+        if product_info:
+            self.apply_product_info(product_info)
+        else:
+            self.fetch_page()
+            self.parse_product_name()
+            self.parse_product_price()
         return {
             'name': self.product_name,
-            'price': self.product_price
+            'price': self.product_price,
+            **self.price_details()
         }
         
     def get_product_name(self):
@@ -122,6 +260,254 @@ class ProductParser:
             logging.info(f"Price: {product_info['price']}")
             logging.info('-' * 40)
 
+class AsyncProductParser(ProductParser):
+    def __init__(self, url, client, timeout=15, backend=DEFAULT_BACKEND, stream=False, max_bytes=2 * 1024 * 1024,
+                 stream_heuristic=False, scheduler=None, revalidation=None, cache_key=None, snapshots=None, extractor=None):
+        super().__init__(url, timeout, backend, snapshots)
+        self.client = client
+        self.extractor = extractor
+        self.extracted = None
+        self.scheduler = scheduler
+        self.revalidation = revalidation
+        self.cache_key = cache_key or url
+        self.validated = None
+        self.not_modified = False
+        self.status_code = None
+        self.response_headers = {}
+        self.timings = {}
+        self.trace = RequestTrace()
+        self.error = None
+        self.host = (urlsplit(url).hostname or "").lower()
+        self.stream = stream
+        self.stream_heuristic = stream_heuristic
+        self.max_bytes = max_bytes
+        self.bytes_downloaded = 0
+        self.truncated = False
+
+    async def before_request(self):
+        if self.scheduler:
+            await self.scheduler.acquire(self.host)
+
+    def after_response(self, response):
+        if self.scheduler:
+            self.scheduler.record(self.host, response.status_code, response.headers.get('Retry-After'))
+
+    def after_failure(self, err):
+        if self.scheduler and isinstance(err, (httpx.TimeoutException, httpx.NetworkError)):
+            self.scheduler.record_failure(self.host)
+
+    async def record_snapshot(self, url, status, headers, body, encoding):
+        if self.recording:
+            # Compressing and writing the snapshot would otherwise block the event loop.
+            await asyncio.to_thread(self.snapshots.save, url, status, headers, body, encoding or 'utf-8')
+
+    def page_headers(self):
+        if self.revalidation:
+            self.validated = self.revalidation.lookup(self.cache_key)
+            return {**self.headers, **self.revalidation.conditional_headers(self.validated)}
+        return self.headers
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - started
+
+    def timing_breakdown(self):
+        """Время запроса по фазам: соединение, до первого байта, загрузка тела, разбор"""
+        connect, ttfb = self.trace.connect, self.trace.ttfb
+        return {
+            'host_wait': self.timings.get('host_wait', 0.0),
+            'connect': connect,
+            'ttfb': ttfb,
+            'download': max(0.0, self.timings.get('fetch', 0.0) - connect - ttfb),
+            'parse': sum(self.timings.get(stage, 0.0) for stage in PARSE_STAGES)
+        }
+
+    def outcomes(self):
+        """'ok', или причина неудачи: http_error / timeout / throttled / error при загрузке, name_not_found / price_not_found"""
+        if self.error:
+            return [self.error]
+        outcomes = []
+        if self.product_name in (None, "Name not found"):
+            outcomes.append('name_not_found')
+        if self.product_price in (None, "Price not found"):
+            outcomes.append('price_not_found')
+        return outcomes or ['ok']
+
+    def check_not_modified(self, response):
+        # 304 means the stored product_info is still current: skip the body entirely.
+        if self.validated:
+            self.not_modified = response.status_code == 304
+            self.revalidation.record(self.validated, self.not_modified)
+        self.status_code = response.status_code
+        self.response_headers = response.headers
+        return self.not_modified
+
+    async def fetch_page(self):
+        try:
+            if self.replaying:
+                with self.stage('fetch'):
+                    body, encoding = self.replay_page().encode(), 'utf-8'
+            elif self.stream and not self.recording:
+                with self.stage('host_wait'):
+                    await self.before_request()
+                with self.stage('fetch'):
+                    html = await self.read_streaming()
+                if html is None:
+                    return
+                body, encoding = html.encode(), 'utf-8'
+            else:
+                # Snapshots keep the whole raw body with its original encoding, so recording never streams.
+                with self.stage('host_wait'):
+                    await self.before_request()
+                with self.stage('fetch'):
+                    response = await self.client.get(self.url, headers=self.page_headers(), timeout=self.timeout,
+                                                     extensions={'trace': self.trace})
+                self.after_response(response)
+                if self.check_not_modified(response):
+                    return
+                response.raise_for_status()
+                remember_site(self.url, response.headers)
+                self.bytes_downloaded = response.num_bytes_downloaded or len(response.content)
+                body, encoding = response.content, response.encoding
+                await self.record_snapshot(self.url, response.status_code, response.headers, body, encoding)
+            with self.stage('html_build'):
+                if self.extractor:
+                    # Tree building and the price scan run in a worker process; only the result dict comes back.
+                    try:
+                        self.extracted = await self.extractor.extract(body, encoding, self.url, self.backend)
+                    except BrokenProcessPool:
+                        # The pool has been recreated for later requests; this page is parsed in-process.
+                        self.load_html(body.decode(encoding or 'utf-8', errors='replace'))
+                else:
+                    self.load_html(body.decode(encoding or 'utf-8', errors='replace'))
+        except httpx.HTTPStatusError as http_err:
+            self.error = 'http_error'
+            logging.error(f"HTTP error occurred: {http_err}")
+        except HostThrottled as err:
+            # Our own rate limit for the host, not a failure of the shop: nothing was sent.
+            self.error = 'throttled'
+            logging.warning(f"Not fetching {self.url}: {err}")
+        except httpx.TimeoutException as err:
+            self.error = 'timeout'
+            self.after_failure(err)
+            logging.error(f"Timeout after {self.timeout} seconds on {self.url}.")
+        except Exception as err:
+            self.error = 'error'
+            self.after_failure(err)
+            logging.error(f"Other error occurred: {err}")
+
+    async def read_streaming(self):
+        # Stop reading the socket as soon as the detector has confident name and price
+        # candidates, or once max_bytes of decoded text have been received (num_bytes_downloaded
+        # counts compressed wire bytes); the prefix is parsed as usual.
+        detector = StreamingDetector(NAME_SEARCH_TAGS[0], heuristic=self.stream_heuristic)
+        chunks = []
+        received = 0
+        async with self.client.stream('GET', self.url, headers=self.page_headers(), timeout=self.timeout,
+                                      extensions={'trace': self.trace}) as response:
+            self.after_response(response)
+            if self.check_not_modified(response):
+                return None
+            response.raise_for_status()
+            remember_site(self.url, response.headers)
+            async for chunk in response.aiter_text():
+                chunks.append(chunk)
+                received += len(chunk)
+                detector.feed(chunk)
+                self.bytes_downloaded = response.num_bytes_downloaded
+                if detector.is_confident():
+                    self.truncated = True
+                    break
+                if received >= self.max_bytes:
+                    logging.warning(f"Stopped reading {self.url} after {received} decoded characters.")
+                    self.truncated = True
+                    break
+        return ''.join(chunks)
+
+    async def fetch_json(self, url):
+        if self.replaying:
+            return json.loads(self.load_snapshot(url).text)
+        with self.stage('host_wait'):
+            await self.before_request()
+        with self.stage('fetch'):
+            response = await self.client.get(url, headers=self.json_headers(), timeout=self.timeout,
+                                             extensions={'trace': self.trace})
+        self.after_response(response)
+        response.raise_for_status()
+        await self.record_snapshot(url, response.status_code, response.headers, response.content, response.encoding)
+        return response.json()
+
+    async def fetch_adapter_data(self, adapter):
+        try:
+            data = await self.fetch_json(adapter.data_url(self.url))
+            currency_url = adapter.currency_url(data, self.url)
+            if currency_url:
+                # Storefront currency of a learned Shopify host, fetched once and kept by the adapter.
+                adapter.learn_currency(self.url, await self.fetch_json(currency_url))
+            return adapter.parse(data, self.url)
+        except HostThrottled as err:
+            self.error = 'throttled'
+            logging.warning(f"Not fetching {self.url}: {err}")
+            return None
+        except Exception as err:
+            self.after_failure(err)
+            logging.warning(f"{adapter.name} adapter failed on {self.url}: {err}")
+            return None
+
+    async def get_product_info(self):
+        adapter = find_adapter(self.url)
+        product_info = await self.fetch_adapter_data(adapter) if adapter else None
+        if product_info:
+            self.apply_product_info(product_info)
+        elif self.error != 'throttled':
+            # A throttled adapter request skips the HTML fallback: it would wait on the same host bucket.
+            await self.fetch_page()
+            if self.not_modified:
+                self.apply_product_info(self.validated['product_info'])
+            elif self.extracted:
+                self.apply_product_info(self.extracted)
+                self.remember_validators()
+            else:
+                with self.stage('name'):
+                    self.parse_product_name()
+                with self.stage('price'):
+                    self.parse_product_price()
+                self.remember_validators()
+        return {
+            'name': self.product_name,
+            'price': self.product_price,
+            **self.price_details()
+        }
+
+    def remember_validators(self):
+        if not self.revalidation:
+            return
+        if self.product_name in (None, "Name not found") or self.product_price in (None, "Price not found"):
+            return
+        product_info = {'name': self.product_name, 'price': self.product_price, 'price_source': self.price_source}
+        parse_seconds = sum(self.timings.get(stage, 0.0) for stage in PARSE_STAGES)
+        self.revalidation.store(self.cache_key, self.response_headers, product_info, self.bytes_downloaded, parse_seconds)
+
+    async def get_product_name(self):
+        await self.fetch_page()
+        if self.extracted:
+            self.apply_product_info(self.extracted)
+        else:
+            self.parse_product_name()
+        return self.product_name
+
+    async def get_product_price(self):
+        await self.fetch_page()
+        if self.extracted:
+            self.apply_product_info(self.extracted)
+        else:
+            self.parse_product_price()
+        return self.product_price
+
 if __name__ == "__main__":
     ProductParser.test()
 
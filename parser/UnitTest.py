@@ -1,9 +1,40 @@
+import asyncio
+import gzip
+import os
+import threading
+from decimal import Decimal
 import pytest
 from bs4 import BeautifulSoup
+import httpcore
+import httpx
 import requests
+from concurrent.futures.process import BrokenProcessPool
+from fastapi.testclient import TestClient
 from unittest.mock import Mock, patch
 
-from ProductParser import ProductParser
+from ProductParser import ProductParser, AsyncProductParser
+from batch_writer import BatchWriter
+from circuit_breaker import CircuitBreakers, CircuitOpen
+from concurrency import HostLimiter
+from db import PoolWaitStats
+from extraction import ProcessPoolExtractor, extract_product_info
+from host_scheduler import HostScheduler, HostThrottled, parse_retry_after
+from html_backends import BACKENDS, resolve_backend
+from http_transport import CachingNetworkBackend, DnsCache, PooledTransport
+from jobs import CallbackNotAllowed, JobQueue, JobQueueFull
+from metrics import domain_label, observe_parser, track_domains
+import parser_handler
+from prometheus_client import REGISTRY
+from price_parsing import is_price, normalize_amount, parse_price
+from product_cache import ProductCache
+from request_timing import RequestTrace, server_timing
+from revalidation import RevalidationCache
+from singleflight import SingleFlight
+from site_adapters import ShopifyAdapter
+from snapshot_store import SnapshotStore
+from streaming import StreamingDetector
+from url_utils import canonical_url, registrable_domain
+from user_agents import FALLBACK_USER_AGENTS, UserAgentProvider
 
 def test_fetch_page_failure(mocker):
     mocker.patch('requests.get', side_effect=Exception("Network Error"))
@@ -828,4 +859,1130 @@ def test_parse_product_price_with_nested_tags(mocker):
 
     parser.parse_product_price()
 
-    assert parser.product_price == "$19.99"
\ No newline at end of file
+    assert parser.product_price == "$19.99"
+
+def _mock_async_client(handler):
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler), follow_redirects=True)
+
+def test_async_get_product_info():
+    html = "<html><body><h1>Test Product</h1><span>$19.99</span></body></html>"
+
+    async def run():
+        async with _mock_async_client(lambda request: httpx.Response(200, text=html)) as client:
+            parser = AsyncProductParser('http://example.com', client)
+            return await parser.get_product_info()
+
+    product_info = asyncio.run(run())
+
+    assert product_info['name'] == "Test Product"
+    assert product_info['price'] == "$19.99"
+
+def test_async_fetch_page_http_error():
+    async def run():
+        async with _mock_async_client(lambda request: httpx.Response(404)) as client:
+            parser = AsyncProductParser('http://example.com', client)
+            await parser.fetch_page()
+            return parser
+
+    parser = asyncio.run(run())
+
+    assert parser.soup is None
+
+def test_async_fetch_page_timeout():
+    def handler(request):
+        raise httpx.ReadTimeout("timed out", request=request)
+
+    async def run():
+        async with _mock_async_client(handler) as client:
+            parser = AsyncProductParser('http://example.com', client)
+            return await parser.get_product_info()
+
+    product_info = asyncio.run(run())
+
+    assert product_info['price'] == "Price not found"
+
+def test_pool_wait_stats_snapshot():
+    stats = PoolWaitStats(buckets=(0.01, 0.1))
+    stats.observe(0.005)
+    stats.observe(0.05)
+    stats.observe(0.5)
+
+    snapshot = stats.snapshot()
+
+    assert snapshot["acquired"] == 3
+    assert snapshot["max_wait_ms"] == 500.0
+    assert snapshot["wait_histogram"] == {"le_0.01": 1, "le_0.1": 1, "le_inf": 1}
+
+def test_product_cache_hit_and_ttl_expiry():
+    now = [0.0]
+    cache = ProductCache(ttl=10, clock=lambda: now[0])
+    cache.set("https://kith.com/products/a", {'name': "Test Product", 'price': "$19.99"})
+
+    assert cache.get("https://kith.com/products/a") == {'name': "Test Product", 'price': "$19.99"}
+    now[0] = 11.0
+    assert cache.get("https://kith.com/products/a") is None
+    assert cache.hits == 1
+    assert cache.misses == 1
+
+def test_product_cache_lru_eviction_by_entries_and_bytes():
+    cache = ProductCache(max_entries=2)
+    cache.set("a", {'name': "A"})
+    cache.set("b", {'name': "B"})
+    cache.get("a")
+    cache.set("c", {'name': "C"})
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+
+    small = ProductCache(max_bytes=60)
+    small.set("a", {'name': "x" * 20})
+    small.set("b", {'name': "y" * 20})
+
+    assert len(small) == 1
+    assert small.bytes <= 60
+
+def test_canonical_url_drops_fragment_and_tracking():
+    url = "HTTPS://Kith.com:443/products/aaih3432?utm_source=tg&b=2&a=1#reviews"
+
+    assert canonical_url(url) == "https://kith.com/products/aaih3432?a=1&b=2"
+
+@pytest.mark.parametrize("url, expected", [
+    ("https://www.ebay.com/itm/126523570030?_nkw=fa+t+shirt&itmmeta=01J7AT6Q&hash=item1d75:g:S~cAAOS&itmprp=enc%3AAQAJ",
+     "https://ebay.com/itm/126523570030"),
+    ("https://www.ebay.com/itm/FA-T-Shirt-Black/126523570030", "https://ebay.com/itm/126523570030"),
+    ("https://www.grailed.com/listings/67108758-arc-teryx?g_aidx=Listing_by_heat_production&g_aqid=02fab20a",
+     "https://grailed.com/listings/67108758-arc-teryx"),
+    ("https://www.asos.com/asos-design/top/prd/205945056#colourWayId-205945063",
+     "https://asos.com/asos-design/top/prd/205945056"),
+    ("https://stockx.com/air-jordan-4-retro-white-thunder?size=4&country=US&utm_medium=tg",
+     "https://stockx.com/air-jordan-4-retro-white-thunder?size=4"),
+    ("https://kith.com/products/aaih3432?variant=42&fbclid=abc", "https://kith.com/products/aaih3432?variant=42"),
+])
+def test_canonical_url_domain_rules(url, expected):
+    assert canonical_url(url) == expected
+
+def test_singleflight_shares_one_call():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {'name': "Test Product", 'price': "$19.99"}
+
+    async def run():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do("key", fetch) for _ in range(5)))
+        return flight, results
+
+    flight, results = asyncio.run(run())
+
+    assert len(calls) == 1
+    assert all(result == results[0] for result in results)
+    assert flight.shared == 4
+    assert len(flight) == 0
+
+def test_singleflight_propagates_errors_to_all_waiters():
+    async def fetch():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("blocked")
+
+    async def run():
+        flight = SingleFlight()
+        return await asyncio.gather(flight.do("key", fetch), flight.do("key", fetch), return_exceptions=True)
+
+    results = asyncio.run(run())
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+def test_host_limiter_caps_per_host_concurrency():
+    active = {"kith.com": 0, "palace.com": 0}
+    peak = {"kith.com": 0, "palace.com": 0}
+
+    async def work(limiter, host):
+        async with limiter.limit(host):
+            active[host] += 1
+            peak[host] = max(peak[host], active[host])
+            await asyncio.sleep(0.01)
+            active[host] -= 1
+
+    async def run():
+        limiter = HostLimiter(global_limit=10, per_host_limit=2)
+        await asyncio.gather(*(work(limiter, host) for host in ["kith.com", "palace.com"] * 5))
+        return limiter
+
+    limiter = asyncio.run(run())
+
+    assert peak == {"kith.com": 2, "palace.com": 2}
+    assert limiter.snapshot()["hosts"] == {}
+
+def test_shopify_adapter_uses_product_json():
+    product_json = {"product": {"title": "FA Converse Chuck 70", "variants": [
+        {"id": 1, "price": "110.00", "presentment_prices": [{"price": {"amount": "110.00", "currency_code": "USD"}}]},
+        {"id": 2, "price": "120.00"}
+    ]}}
+    requested = []
+
+    def handler(request):
+        requested.append(str(request.url))
+        return httpx.Response(200, json=product_json)
+
+    async def run():
+        async with _mock_async_client(handler) as client:
+            parser = AsyncProductParser('https://kith.com/collections/mens-footwear/products/aaih3432', client)
+            return await parser.get_product_info()
+
+    product_info = asyncio.run(run())
+
+    assert requested == ['https://kith.com/products/aaih3432.json']
+    assert product_info == {'name': "FA Converse Chuck 70", 'price': "$110.00",
+                            'price_amount': "110.00", 'price_currency': "USD", 'confidence': 0.95}
+
+def test_shopify_adapter_store_currency_without_presentment_prices():
+    product_json = {"product": {"title": "Tri-Ferg Hood", "variants": [{"id": 1, "price": "128.00"}]}}
+    requested = []
+
+    def handler(request):
+        requested.append(request.url.path)
+        if request.url.path == "/cart.js":
+            return httpx.Response(200, json={"currency": "EUR", "items": []})
+        return httpx.Response(200, json=product_json)
+
+    adapter = ShopifyAdapter()
+    adapter.learned_hosts.add("learned-shop.com")
+
+    async def run(url):
+        async with _mock_async_client(handler) as client:
+            parser = AsyncProductParser(url, client)
+            return await parser.fetch_adapter_data(adapter)
+
+    palace = asyncio.run(run('https://shop.palaceskateboards.com/products/a7oh8xvpjvqf'))
+    learned = [asyncio.run(run('https://learned-shop.com/products/hood')) for _ in range(2)]
+
+    assert palace['price'] == "£128.00"
+    assert learned[0]['price'] == learned[1]['price'] == "€128.00"
+    assert requested.count("/cart.js") == 1
+
+def test_shopify_adapter_falls_back_to_html(mocker):
+    html = "<html><body><h1>Test Product</h1><span>$19.99</span></body></html>"
+    json_response = mocker.Mock()
+    json_response.json.side_effect = ValueError("not json")
+    html_response = mocker.Mock()
+    html_response.status_code = 200
+    html_response.text = html
+    mocker.patch('requests.get', side_effect=[json_response, html_response])
+
+    parser = ProductParser('https://dimemtl.com/products/fa24-coverstitch-sherpa-fleece-military-brown')
+    product_info = parser.get_product_info()
+
+    assert product_info == {'name': "Test Product", 'price': "$19.99",
+                            'price_amount': "19.99", 'price_currency': "USD", 'confidence': 0.6}
+
+def test_structured_data_json_ld_preferred_over_heuristics():
+    html = """<html><head><title>Kith | Shop</title>
+    <script type="application/ld+json">{"@context": "https://schema.org", "@type": "Product", "name": "Test Product",
+    "offers": {"@type": "Offer", "price": "19.99", "priceCurrency": "USD"}}</script>
+    </head><body><div>Menu</div><span>$5.00 shipping</span></body></html>"""
+    parser = ProductParser('http://example.com', backend='html.parser')
+    parser.load_html(html)
+    parser.parse_product_name()
+    parser.parse_product_price()
+
+    assert parser.product_name == "Test Product"
+    assert parser.product_price == "$19.99"
+    assert parser.soup.find('body') is None
+
+def test_structured_data_open_graph_price_meta():
+    html = """<html><head><meta property="og:title" content="Test Product">
+    <meta property="product:price:amount" content="1299.00"><meta property="product:price:currency" content="EUR">
+    </head><body><h1>Other</h1></body></html>"""
+    parser = ProductParser('http://example.com')
+    parser.soup = BeautifulSoup(html, 'html.parser')
+    parser.parse_product_name()
+    parser.parse_product_price()
+
+    assert parser.product_name == "Test Product"
+    assert parser.product_price == "€1299.00"
+
+def test_structured_data_falls_back_to_full_page():
+    html = """<html><head><meta property="og:title" content="Test Product"></head>
+    <body><h1>Heading</h1><span>$19.99</span></body></html>"""
+    parser = ProductParser('http://example.com')
+    parser.load_html(html)
+    parser.parse_product_name()
+    parser.parse_product_price()
+
+    assert parser.product_name == "Test Product"
+    assert parser.product_price == "$19.99"
+
+BACKEND_SAMPLES = [
+    "<html><head><title>Test</title></head><body><h1>Test <span>Product</span></h1><span>$19.99</span></body></html>",
+    "<html><body><div class=\"product-name\">Test &amp; Product<!-- comment --></div><span>19,99€</span></body></html>",
+    "<html><body><div><script>var x = 1;</script>Test Product</div><span><b>£1,234.56</b></span></body></html>",
+    "<html><body><span>Only $19.99 today!</span><span>$29.99</span></body></html>",
+    "<html><body><p>No name</p><span>a <i>$5</i></span></body></html>",
+    """<html><head><script type="application/ld+json">{"@type": "Product", "name": "Test Product",
+    "offers": {"price": "19.99", "priceCurrency": "USD"}}</script></head><body></body></html>""",
+]
+
+@pytest.mark.parametrize("backend", [b for b in BACKENDS if resolve_backend(b) == b])
+@pytest.mark.parametrize("html", BACKEND_SAMPLES)
+def test_html_backends_produce_same_output(backend, html):
+    expected = ProductParser('http://example.com', backend='html.parser')
+    expected.load_html(html)
+    expected.parse_product_name()
+    expected.parse_product_price()
+
+    parser = ProductParser('http://example.com', backend=backend)
+    parser.load_html(html)
+    parser.parse_product_name()
+    parser.parse_product_price()
+
+    assert (parser.product_name, parser.product_price) == (expected.product_name, expected.product_price)
+
+@pytest.mark.parametrize("text, expected", [
+    ("$100", (Decimal("100"), "USD")),
+    ("100 USD", (Decimal("100"), "USD")),
+    ("12 000 руб.", (Decimal("12000"), "RUB")),
+    ("1.299,00 €", (Decimal("1299.00"), "EUR")),
+    ("€1,299.00", (Decimal("1299.00"), "EUR")),
+    ("19,99€", (Decimal("19.99"), "EUR")),
+    ("1.299 €", (Decimal("1299"), "EUR")),
+    ("€1.299", (Decimal("1299"), "EUR")),
+    ("2.500 ₽", (Decimal("2500"), "RUB")),
+    ("$0.299", (Decimal("0.299"), "USD")),
+    ("Size 10 - £110", (Decimal("110"), "GBP")),
+    ("Price not found", None),
+])
+def test_parse_price_normalizes_amount_and_currency(text, expected):
+    assert parse_price(text) == expected
+
+def test_parse_price_default_currency_and_is_price():
+    assert parse_price("1000", default_currency="USD") == (Decimal("1000"), "USD")
+    assert parse_price("1000") is None
+    assert is_price(" 12000 руб. ")
+    assert not is_price("https://kith.com/products/aaih3432")
+    assert normalize_amount("1,234") == Decimal("1234")
+
+@pytest.mark.parametrize("html, expected", [
+    ("""<html><head><meta property="product:price:amount" content="1299.00">
+    <meta property="product:price:currency" content="EUR"></head><body><h1>Test Product</h1></body></html>""",
+     {'price_amount': "1299.00", 'price_currency': "EUR", 'confidence': 0.9}),
+    ("<html><body><h1>Test Product</h1><span class='price'>1.299,00 €</span></body></html>",
+     {'price_amount': "1299.00", 'price_currency': "EUR", 'confidence': 0.6}),
+    ("<html><body><h1>Test Product</h1><span>€ 1.299</span></body></html>",
+     {'price_amount': "1299", 'price_currency': "EUR", 'confidence': 0.6}),
+    ("<html><body><h1>Test Product</h1></body></html>",
+     {'price_amount': None, 'price_currency': None, 'confidence': 0.0}),
+])
+def test_price_details_amount_currency_and_confidence(html, expected):
+    parser = ProductParser('http://example.com')
+    parser.load_html(html)
+    parser.parse_product_price()
+
+    assert parser.price_details() == expected
+
+def test_price_parsing_copy_in_user_bot_is_identical():
+    here = os.path.dirname(os.path.abspath(__file__))
+    copy_path = os.path.join(here, os.pardir, "user_bot", "price_parsing.py")
+    if not os.path.exists(copy_path):
+        pytest.skip("bot sources are not available in this build context")
+    with open(os.path.join(here, "price_parsing.py"), encoding="utf-8") as original, open(copy_path, encoding="utf-8") as copy:
+        assert copy.read() == original.read()
+
+def _chunked_page_handler(chunks, sent):
+    async def body():
+        for chunk in chunks:
+            sent.append(chunk)
+            yield chunk.encode()
+
+    return lambda request: httpx.Response(200, headers={"content-type": "text/html; charset=utf-8"}, content=body())
+
+def test_async_streaming_stops_after_name_and_price():
+    chunks = ["<html><head><title>Shop</title></head><body><h1>Test Product</h1>",
+              "<div><span>$19.99</span></div>"] + ["<div>" + "x" * 1000 + "</div>"] * 50
+    sent = []
+
+    async def run():
+        async with _mock_async_client(_chunked_page_handler(chunks, sent)) as client:
+            parser = AsyncProductParser('http://example.com', client, stream=True, stream_heuristic=True)
+            product_info = await parser.get_product_info()
+            return parser, product_info
+
+    parser, product_info = asyncio.run(run())
+
+    assert product_info == {'name': "Test Product", 'price': "$19.99",
+                            'price_amount': "19.99", 'price_currency': "USD", 'confidence': 0.6}
+    assert parser.truncated
+    assert len(sent) < len(chunks)
+
+def test_async_streaming_reads_json_ld_below_cart_price():
+    chunks = ["<html><body><header><span>$0.00</span></header><h1>Test Product</h1>"]
+    chunks += ["<div>" + "x" * 1000 + "</div>"] * 5
+    chunks += ["""<script type="application/ld+json">{"@type": "Product", "name": "Test Product",
+    "offers": {"price": "250.00", "priceCurrency": "USD"}}</script>"""] + ["<div>" + "x" * 1000 + "</div>"] * 20
+    sent = []
+
+    async def run():
+        async with _mock_async_client(_chunked_page_handler(chunks, sent)) as client:
+            parser = AsyncProductParser('http://example.com', client, stream=True)
+            return await parser.get_product_info()
+
+    product_info = asyncio.run(run())
+
+    assert product_info['price'] == "$250.00" and product_info['confidence'] == 0.9
+    assert len(sent) < len(chunks)
+
+def test_async_streaming_respects_max_bytes():
+    chunks = ["<html><body>"] + ["<div>" + "x" * 1000 + "</div>"] * 50
+    sent = []
+
+    async def run():
+        async with _mock_async_client(_chunked_page_handler(chunks, sent)) as client:
+            parser = AsyncProductParser('http://example.com', client, stream=True, max_bytes=5000)
+            await parser.get_product_info()
+            return parser
+
+    parser = asyncio.run(run())
+
+    assert parser.truncated
+    assert 5000 <= parser.bytes_downloaded < 10000
+
+def test_async_streaming_caps_decoded_length_of_compressed_page():
+    # Повторяющаяся разметка сжимается в десятки раз: лимит на сжатые байты пропустил бы всю страницу
+    html = "<html><body>" + "<div class='description'>Test Product</div>" * 5000 + "</body></html>"
+    body = gzip.compress(html.encode())
+
+    async def content():
+        for start in range(0, len(body), 256):
+            yield body[start:start + 256]
+
+    def handler(request):
+        return httpx.Response(200, headers={"content-type": "text/html; charset=utf-8", "content-encoding": "gzip"},
+                              content=content())
+
+    async def run():
+        async with _mock_async_client(handler) as client:
+            parser = AsyncProductParser('http://example.com', client, stream=True, max_bytes=len(body))
+            await parser.get_product_info()
+            return parser
+
+    parser = asyncio.run(run())
+
+    assert parser.truncated
+    assert parser.bytes_downloaded < len(body)
+    assert len(str(parser.soup)) < len(html) // 2
+
+def test_streaming_detector_requires_single_text_price_span():
+    detector = StreamingDetector(heuristic=True)
+    detector.feed("<h1>Test Product</h1><span>Price <b>$19.99</b></span>")
+    assert not detector.is_confident()
+
+    detector.feed("<span>$19.99</span>")
+    assert detector.is_confident()
+
+    default = StreamingDetector()
+    default.feed("<h1>Test Product</h1><span>$19.99</span>")
+    assert not default.is_confident()
+
+def test_user_agent_provider_loads_once_and_rotates(mocker):
+    entries = iter([{"useragent": f"agent-{i}", "type": "desktop" if i % 2 else "mobile"} for i in range(10)])
+    fake_ua = mocker.Mock()
+    type(fake_ua).getRandom = mocker.PropertyMock(side_effect=lambda: next(entries))
+    user_agent_cls = mocker.patch('user_agents.UserAgent', return_value=fake_ua)
+
+    provider = UserAgentProvider(pool_size=10, domain_weights={"stockx.com": {"desktop": 1}})
+    agents = {provider.get() for _ in range(20)}
+    stockx_agents = {provider.get("https://www.stockx.com/air-jordan-4") for _ in range(20)}
+
+    assert user_agent_cls.call_count == 1
+    assert len(agents) == 10
+    assert stockx_agents <= {f"agent-{i}" for i in range(1, 10, 2)}
+
+def test_user_agent_provider_falls_back_without_dataset(mocker):
+    mocker.patch('user_agents.UserAgent', side_effect=Exception("no data"))
+
+    provider = UserAgentProvider()
+
+    assert provider.get() in FALLBACK_USER_AGENTS
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.now += seconds
+
+def test_host_scheduler_token_bucket_spaces_requests():
+    clock = FakeClock()
+    scheduler = HostScheduler(rate=2.0, burst=2, clock=clock, sleep=clock.sleep)
+
+    async def run():
+        for _ in range(4):
+            await scheduler.acquire("stockx.com")
+
+    asyncio.run(run())
+
+    assert clock.now == pytest.approx(1.0)
+
+def test_host_scheduler_max_wait_counts_queued_callers():
+    waits = []
+
+    async def sleep(seconds):
+        waits.append(seconds)
+
+    scheduler = HostScheduler(rate=2.0, burst=4, max_wait=10, clock=lambda: 0.0, sleep=sleep)
+
+    async def run():
+        return await asyncio.gather(*(scheduler.acquire("stockx.com") for _ in range(40)), return_exceptions=True)
+
+    results = asyncio.run(run())
+
+    throttled = [result for result in results if isinstance(result, HostThrottled)]
+    assert len(throttled) == 16
+    assert max(waits) == 10.0
+
+def test_host_scheduler_refunds_token_when_wait_is_abandoned():
+    scheduler = HostScheduler(rate=1.0, burst=1, max_wait=10, clock=lambda: 0.0)
+
+    async def run():
+        await scheduler.acquire("stockx.com")
+        waiter = asyncio.ensure_future(scheduler.acquire("stockx.com"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+
+    asyncio.run(run())
+
+    assert scheduler._buckets["stockx.com"].tokens == 0.0
+    assert scheduler.snapshot()["stockx.com"]["queue_depth"] == 0
+
+def test_async_parser_reports_local_throttling_as_throttled():
+    sent = []
+    scheduler = HostScheduler(max_wait=5)
+    scheduler.record("example.com", 429, retry_after="60")
+
+    async def run():
+        async with _mock_async_client(lambda request: sent.append(request) or httpx.Response(200)) as client:
+            parser = AsyncProductParser('http://example.com/p', client, scheduler=scheduler)
+            await parser.get_product_info()
+            return parser
+
+    parser = asyncio.run(run())
+
+    assert parser.outcomes() == ['throttled']
+    assert sent == []
+
+def test_host_scheduler_backs_off_and_recovers():
+    clock = FakeClock()
+    scheduler = HostScheduler(rate=2.0, burst=1, backoff=0.5, recovery=0.25, max_wait=5, clock=clock, sleep=clock.sleep)
+
+    scheduler.record("stockx.com", 429)
+    assert scheduler.snapshot()["stockx.com"]["rate"] == 1.0
+
+    scheduler.record("stockx.com", 503, retry_after="30")
+    with pytest.raises(HostThrottled):
+        asyncio.run(scheduler.acquire("stockx.com"))
+
+    scheduler.record("stockx.com", 200)
+    scheduler.record("stockx.com", 200)
+    assert scheduler.snapshot()["stockx.com"]["rate"] == 1.5
+
+def test_dns_cache_respects_ttl_and_shares_lookups():
+    clock = FakeClock()
+    lookups = []
+
+    async def resolver(host, port):
+        lookups.append(host)
+        await asyncio.sleep(0)
+        return ["203.0.113.7"]
+
+    dns = DnsCache(ttl=60, clock=clock, resolver=resolver)
+
+    async def run():
+        first = await asyncio.gather(*(dns.resolve("kith.com", 443) for _ in range(3)))
+        cached = await dns.resolve("kith.com", 443)
+        clock.now += 61
+        expired = await dns.resolve("kith.com", 443)
+        return first, cached, expired, await dns.resolve("203.0.113.8", 443)
+
+    first, cached, expired, literal = asyncio.run(run())
+
+    assert first == [["203.0.113.7"]] * 3 and cached == expired == ["203.0.113.7"]
+    assert literal == ["203.0.113.8"]
+    assert lookups == ["kith.com", "kith.com"]
+    assert dns.snapshot()["hits"] == 1
+
+def test_pooled_transport_reuses_keep_alive_connection():
+    response = b"HTTP/1.1 200 OK\r\nContent-Type: text/html\r\nContent-Length: 2\r\n\r\nok"
+    limits = httpx.Limits(max_connections=10, max_keepalive_connections=10, keepalive_expiry=30)
+    transport = PooledTransport(limits, http2=False, backend=httpcore.AsyncMockBackend([response, response]))
+    resolved = []
+
+    async def resolver(host, port):
+        resolved.append(host)
+        return ["203.0.113.7"]
+
+    transport.dns.resolver = resolver
+
+    async def run():
+        async with httpx.AsyncClient(transport=transport) as client:
+            for _ in range(2):
+                assert (await client.get("https://kith.com/products/a")).text == "ok"
+
+    asyncio.run(run())
+
+    assert transport.snapshot()["requests"] == 2
+    assert transport.connections_opened == 1
+    assert transport.reuse_ratio == 0.5
+    assert resolved == ["kith.com"]
+
+class BlackholeBackend(httpcore.AsyncNetworkBackend):
+    """Первые адреса не отвечают до истечения timeout, последний подключается"""
+
+    def __init__(self, clock, reachable):
+        self.clock = clock
+        self.reachable = reachable
+        self.attempts = []
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        self.attempts.append((host, timeout))
+        if host != self.reachable:
+            self.clock.now += timeout
+            raise httpcore.ConnectTimeout(f"{host} timed out")
+        return httpcore.AsyncMockStream([])
+
+def test_caching_backend_caps_timeout_per_address():
+    clock = FakeClock()
+    addresses = ["2001:db8::1", "2001:db8::2", "203.0.113.7"]
+
+    async def resolver(host, port):
+        return addresses
+
+    async def connect(timeout, reachable):
+        backend = BlackholeBackend(clock, reachable)
+        network = CachingNetworkBackend(DnsCache(resolver=resolver), backend, attempt_timeout=3.0, clock=clock)
+        try:
+            await network.connect_tcp("kith.com", 443, timeout=timeout)
+        except httpcore.ConnectTimeout:
+            pass
+        return backend.attempts
+
+    assert asyncio.run(connect(15, "203.0.113.7")) == [
+        ("2001:db8::1", 3.0), ("2001:db8::2", 3.0), ("203.0.113.7", 9.0)
+    ]
+    # Весь timeout ушел на первые адреса: до последнего дело не доходит
+    assert asyncio.run(connect(5, None)) == [("2001:db8::1", 3.0), ("2001:db8::2", 2.0)]
+    assert asyncio.run(connect(None, "203.0.113.7"))[-1] == ("203.0.113.7", None)
+
+def test_parse_retry_after_http_date():
+    assert parse_retry_after("120") == 120.0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT", now=1445412420.0) == 60.0
+    assert parse_retry_after("soon") is None
+
+def test_registrable_domain():
+    assert registrable_domain("https://www.dw4.co/product/123") == "dw4.co"
+    assert registrable_domain("https://shop-jp.doverstreetmarket.com/products/x") == "doverstreetmarket.com"
+    assert registrable_domain("https://m.ebay.co.uk/itm/1") == "ebay.co.uk"
+
+def test_circuit_breaker_opens_and_half_opens():
+    clock = FakeClock()
+    breakers = CircuitBreakers(failure_threshold=2, reset_timeout=60, max_reset_timeout=100, clock=clock)
+
+    breakers.record_failure("dw4.co")
+    breakers.check("dw4.co")
+    breakers.record_failure("dw4.co")
+    with pytest.raises(CircuitOpen):
+        breakers.check("dw4.co")
+
+    clock.now = 61
+    breakers.check("dw4.co")
+    with pytest.raises(CircuitOpen):
+        breakers.check("dw4.co")
+    breakers.record_failure("dw4.co", started=61)
+    assert breakers.snapshot()["dw4.co"]["reset_timeout"] == 100
+
+    clock.now = 162
+    breakers.check("dw4.co")
+    breakers.record_success("dw4.co", started=162)
+    breakers.check("dw4.co")
+    assert breakers.snapshot() == {}
+
+def test_circuit_breaker_ignores_results_started_before_opening():
+    clock = FakeClock()
+    breakers = CircuitBreakers(failure_threshold=1, reset_timeout=60, clock=clock)
+
+    clock.now = 10
+    breakers.record_failure("dw4.co", started=5)
+    breakers.record_success("dw4.co", started=3)
+    with pytest.raises(CircuitOpen):
+        breakers.check("dw4.co")
+
+    clock.now = 71
+    breakers.check("dw4.co")
+    breakers.record_success("dw4.co", started=8)
+    breakers.record_failure("dw4.co", started=9)
+    assert breakers.snapshot()["dw4.co"]["state"] == "half_open"
+    assert breakers.snapshot()["dw4.co"]["reset_timeout"] == 60
+
+    # Проба упала в наш лимит на хост: цепь ждет следующую пробу, а не закрывается
+    breakers.release("dw4.co", started=71)
+    breakers.check("dw4.co")
+    with pytest.raises(CircuitOpen):
+        breakers.check("dw4.co")
+
+    # Проба без ответа дольше reset_timeout уступает место следующей
+    clock.now = 131
+    breakers.check("dw4.co")
+    breakers.record_success("dw4.co", started=131)
+    assert breakers.snapshot() == {}
+
+def test_guarded_fetch_does_not_count_local_throttling_as_failure(mocker):
+    clock = FakeClock()
+    breakers = CircuitBreakers(failure_threshold=1, reset_timeout=60, clock=clock)
+    mocker.patch.object(parser_handler, "breakers", breakers)
+    fetch = mocker.patch.object(parser_handler, "fetch_product_info")
+    fetch.return_value = ({"name": None, "price": None, "error": "throttled"}, {})
+
+    asyncio.run(parser_handler.guarded_fetch("https://dw4.co/p/1", "dw4.co/p/1", "dw4.co"))
+    assert breakers.snapshot() == {}
+
+    breakers.record_failure("dw4.co", started=0)
+    clock.now = 61
+    breakers.check("dw4.co")
+    asyncio.run(parser_handler.guarded_fetch("https://dw4.co/p/1", "dw4.co/p/1", "dw4.co"))
+    assert breakers.snapshot()["dw4.co"]["state"] == "half_open"
+    breakers.check("dw4.co")
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_async_revalidation_reuses_product_info_on_304(stream):
+    html = "<html><body><h1>Test Product</h1><span>$19.99</span></body></html>"
+    seen = []
+
+    def handler(request):
+        seen.append(request.headers.get("If-None-Match"))
+        if request.headers.get("If-None-Match") == '"v1"':
+            return httpx.Response(304)
+        response = _chunked_page_handler([html], [])(request)
+        response.headers["ETag"] = '"v1"'
+        return response
+
+    async def run():
+        revalidation = RevalidationCache()
+        async with _mock_async_client(handler) as client:
+            first = AsyncProductParser('http://example.com', client, stream=stream, revalidation=revalidation)
+            await first.get_product_info()
+            second = AsyncProductParser('http://example.com', client, stream=stream, revalidation=revalidation)
+            return second, await second.get_product_info(), revalidation
+
+    parser, product_info, revalidation = asyncio.run(run())
+
+    assert seen == [None, '"v1"']
+    assert product_info == {'name': "Test Product", 'price': "$19.99",
+                            'price_amount': "19.99", 'price_currency': "USD", 'confidence': 0.6}
+    assert parser.not_modified and parser.soup is None
+    assert revalidation.snapshot()["hit_rate"] == 1.0
+    assert revalidation.snapshot()["bytes_saved"] > 0
+
+@pytest.mark.parametrize("compression", ["gzip", "zstd"])
+def test_snapshot_store_record_and_replay(tmp_path, compression):
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    html = "<html><body><h1>Test Product</h1><span>$19.99</span></body></html>"
+    requests_seen = []
+
+    def handler(request):
+        requests_seen.append(request.url)
+        return httpx.Response(200, headers={"Content-Type": "text/html; charset=utf-8"}, text=html)
+
+    async def run(store):
+        async with _mock_async_client(handler) as client:
+            parser = AsyncProductParser('http://example.com', client, snapshots=store)
+            return await parser.get_product_info()
+
+    recorded = asyncio.run(run(SnapshotStore(str(tmp_path), mode='record', compression=compression)))
+    replayed = asyncio.run(run(SnapshotStore(str(tmp_path), mode='replay')))
+
+    assert recorded == replayed == {'name': "Test Product", 'price': "$19.99",
+                                     'price_amount': "19.99", 'price_currency': "USD", 'confidence': 0.6}
+    assert len(requests_seen) == 1
+
+def test_snapshot_recording_stores_raw_body_in_streaming_mode(tmp_path):
+    html = ("<html><head><meta name='description' content='x'></head><body><h1>Тестовый товар</h1>"
+            "<span>€19.99</span>" + ("<div>" + "ж" * 1000 + "</div>") * 20 + "</body></html>")
+    body = html.encode("cp1251")
+    store = SnapshotStore(str(tmp_path), mode='record', compression='gzip')
+
+    def handler(request):
+        return httpx.Response(200, headers={"Content-Type": "text/html; charset=windows-1251"}, content=body)
+
+    async def run():
+        async with _mock_async_client(handler) as client:
+            parser = AsyncProductParser('http://example.com', client, snapshots=store, stream=True,
+                                        stream_heuristic=True)
+            return parser, await parser.get_product_info()
+
+    parser, product_info = asyncio.run(run())
+    snapshot = store.load('http://example.com')
+
+    assert product_info['name'] == "Тестовый товар"
+    assert not parser.truncated
+    assert snapshot.body == body and snapshot.encoding == "windows-1251"
+
+def test_snapshot_store_evicts_oldest_and_dedupes(tmp_path):
+    store = SnapshotStore(str(tmp_path), compression='gzip', max_bytes=10**6)
+    store.save('http://a.com/1', 200, {}, b'same page')
+    store.save('http://a.com/2', 200, {}, b'same page')
+    assert store.snapshot()["objects"] == 1
+
+    store.max_bytes = store.bytes + 2500
+    store.save('http://a.com/3', 200, {}, os.urandom(2000))
+    store.save('http://a.com/4', 200, {}, os.urandom(200))
+
+    assert store.load('http://a.com/1') is None
+    assert store.load('http://a.com/4').body
+    assert store.bytes <= store.max_bytes
+    # Объем считается на ходу и должен совпадать с тем, что лежит на диске
+    assert store.bytes == SnapshotStore(str(tmp_path), compression='gzip').bytes
+
+def test_async_parser_saves_snapshot_off_the_event_loop(tmp_path):
+    store = SnapshotStore(str(tmp_path), mode='record', compression='gzip')
+    save = store.save
+    threads = []
+
+    def recording_save(*args, **kwargs):
+        threads.append(threading.get_ident())
+        return save(*args, **kwargs)
+
+    store.save = recording_save
+    html = "<html><body><h1>Test Product</h1><span>$19.99</span></body></html>"
+
+    async def run():
+        async with _mock_async_client(lambda request: httpx.Response(200, text=html)) as client:
+            await AsyncProductParser('http://example.com', client, snapshots=store).get_product_info()
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(run())
+
+    assert threads and loop_thread not in threads
+    assert store.load('http://example.com').text == html
+
+def test_job_queue_runs_jobs_and_calls_back():
+    clock = FakeClock()
+    notified = []
+
+    async def notify(job):
+        notified.append(job.to_dict())
+        return 200
+
+    async def fail():
+        raise ValueError("boom")
+
+    async def run():
+        queue = JobQueue(workers=2, ttl=60, callback_hosts=["bot"], clock=clock)
+        queue.start(notify)
+        ok = queue.submit(lambda: asyncio.sleep(0, result={"name": "Test Product"}), "http://bot/callback")
+        failed = queue.submit(fail)
+        await queue.join()
+        await queue.stop()
+        return queue, ok, failed
+
+    queue, ok, failed = asyncio.run(run())
+
+    assert queue.get(ok.id).to_dict() == {
+        "job_id": ok.id, "status": "done", "result": {"name": "Test Product"}, "error": None, "callback_status": 200
+    }
+    assert queue.get(failed.id).status == "failed" and queue.get(failed.id).error == "boom"
+    assert [job["job_id"] for job in notified] == [ok.id]
+
+    clock.now = 61
+    assert queue.get(ok.id) is None
+    assert queue.snapshot()["expired"] == 2
+
+def test_job_queue_rejects_when_full():
+    async def run():
+        queue = JobQueue(workers=0, max_queue=1)
+        queue.submit(lambda: asyncio.sleep(0))
+        with pytest.raises(JobQueueFull):
+            queue.submit(lambda: asyncio.sleep(0))
+
+    asyncio.run(run())
+
+@pytest.mark.parametrize("callback_url", [
+    "http://169.254.169.254/latest/meta-data", "http://db:5432/", "file:///etc/passwd", "ftp://bot/callback"
+])
+def test_job_queue_rejects_callbacks_outside_allow_list(callback_url):
+    async def run():
+        queue = JobQueue(workers=0, callback_hosts=["bot"])
+        with pytest.raises(CallbackNotAllowed):
+            queue.submit(lambda: asyncio.sleep(0), callback_url)
+        assert queue.submit(lambda: asyncio.sleep(0), "https://BOT:8443/callback").callback_url
+
+    asyncio.run(run())
+
+def test_extract_product_info_from_bytes():
+    html = "<html><body><h1>Тестовый товар</h1><span>€19.99</span></body></html>".encode("cp1251")
+
+    product_info = extract_product_info(html, "cp1251", 'http://example.com', 'html.parser')
+
+    assert product_info == {'name': "Тестовый товар", 'price': "€19.99", 'price_source': 'page'}
+
+def test_async_parser_offloads_extraction_to_process_pool():
+    html = "<html><body><h1>Test Product</h1><span>$19.99</span></body></html>"
+    extractor = ProcessPoolExtractor(workers=1)
+    extractor.start()
+
+    async def run():
+        async with _mock_async_client(lambda request: httpx.Response(200, text=html)) as client:
+            parser = AsyncProductParser('http://example.com', client, extractor=extractor)
+            return parser, await parser.get_product_info()
+
+    try:
+        parser, product_info = asyncio.run(run())
+    finally:
+        extractor.close()
+
+    assert product_info == {'name': "Test Product", 'price': "$19.99",
+                            'price_amount': "19.99", 'price_currency': "USD", 'confidence': 0.6}
+    assert parser.soup is None
+    assert extractor.snapshot()["completed"] == 1
+
+def test_broken_extraction_pool_is_recreated_and_page_parsed_in_process():
+    html = "<html><body><h1>Test Product</h1><span>$19.99</span></body></html>"
+    extractor = ProcessPoolExtractor(workers=1)
+    extractor.start()
+
+    async def run():
+        async with _mock_async_client(lambda request: httpx.Response(200, text=html)) as client:
+            broken = AsyncProductParser('http://example.com', client, extractor=extractor)
+            recovered = AsyncProductParser('http://example.com', client, extractor=extractor)
+            return await broken.get_product_info(), await recovered.get_product_info(), recovered
+
+    try:
+        # Воркер умирает так же, как при OOM kill
+        with pytest.raises(BrokenProcessPool):
+            extractor._pool.submit(os._exit, 1).result()
+        first, second, recovered = asyncio.run(run())
+    finally:
+        extractor.close()
+
+    assert first['price'] == second['price'] == "$19.99"
+    assert recovered.soup is None
+    assert extractor.snapshot()["restarts"] == 1
+
+def test_async_parser_records_stage_timings_and_outcomes():
+    html = "<html><body><h1>Test Product</h1><div>no price here</div></body></html>"
+
+    async def run():
+        async with _mock_async_client(lambda request: httpx.Response(200, text=html)) as client:
+            parser = AsyncProductParser('http://metrics.example.com', client)
+            await parser.get_product_info()
+            return parser
+
+    parser = asyncio.run(run())
+
+    assert {'host_wait', 'fetch', 'html_build', 'name', 'price'} <= parser.timings.keys()
+    assert parser.outcomes() == ['price_not_found']
+
+    sample = REGISTRY.get_sample_value
+    before = sample('parser_stage_seconds_count', {'stage': 'fetch'}) or 0
+    other = sample('parser_outcomes_total', {'domain': 'other', 'outcome': 'price_not_found'}) or 0
+    known = sample('parser_outcomes_total', {'domain': 'kith.com', 'outcome': 'price_not_found'}) or 0
+    observe_parser(parser, 'metrics.example.com')
+    observe_parser(parser, 'kith.com')
+    assert sample('parser_outcomes_total', {'domain': 'metrics.example.com', 'outcome': 'price_not_found'}) is None
+    assert sample('parser_outcomes_total', {'domain': 'other', 'outcome': 'price_not_found'}) == other + 1
+    assert sample('parser_outcomes_total', {'domain': 'kith.com', 'outcome': 'price_not_found'}) == known + 1
+    assert sample('parser_stage_seconds_count', {'stage': 'fetch'}) == before + 2
+
+def test_metrics_domain_label_is_limited_to_known_shops():
+    assert domain_label('ebay.co.uk') == 'ebay.co.uk'
+    assert domain_label('doverstreetmarket.com') == 'doverstreetmarket.com'
+    assert domain_label('random-shop.example') == 'other'
+    track_domains(['Random-Shop.example'])
+    assert domain_label('random-shop.example') == 'random-shop.example'
+
+def test_async_parser_outcome_for_http_error():
+    async def run():
+        async with _mock_async_client(lambda request: httpx.Response(503)) as client:
+            parser = AsyncProductParser('http://example.com', client)
+            await parser.get_product_info()
+            return parser
+
+    assert asyncio.run(run()).outcomes() == ['http_error']
+
+def test_request_trace_splits_connect_and_ttfb():
+    clock = FakeClock()
+    trace = RequestTrace(clock=clock)
+    events = [
+        (0.0, 'connection.connect_tcp.started'), (0.03, 'connection.connect_tcp.complete'),
+        (0.03, 'connection.start_tls.started'), (0.05, 'connection.start_tls.complete'),
+        (0.05, 'http11.send_request_headers.started'), (0.06, 'http11.send_request_headers.complete'),
+        (0.06, 'http11.receive_response_headers.started'), (0.25, 'http11.receive_response_headers.complete'),
+    ]
+
+    async def run():
+        for at, event in events:
+            clock.now = at
+            await trace(event, {})
+
+    asyncio.run(run())
+
+    assert trace.connect == pytest.approx(0.05)
+    assert trace.ttfb == pytest.approx(0.20)
+    assert server_timing({'connect': 0.05, 'ttfb': 0.2}) == "connect;dur=50.0, ttfb;dur=200.0"
+
+class FakeCopyPool:
+    def __init__(self, fail=False):
+        self.batches = []
+        self.fail = fail
+
+    def acquire(self):
+        pool = self
+
+        class Connection:
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *exc):
+                return False
+
+            async def copy_records_to_table(self, table, records, columns):
+                if pool.fail:
+                    raise ConnectionError("db is down")
+                pool.batches.append((table, columns, list(records)))
+
+        return Connection()
+
+def test_batch_writer_flushes_by_size_and_on_close():
+    pool = FakeCopyPool()
+    inserts_before = REGISTRY.get_sample_value('parser_stage_seconds_count', {'stage': 'db_insert'}) or 0
+
+    async def run():
+        writer = BatchWriter(pool, max_batch=3, flush_interval=60)
+        writer.start()
+        for i in range(7):
+            await writer.write(str(i), '{}')
+        await writer.close()
+        return writer
+
+    writer = asyncio.run(run())
+
+    assert [len(rows) for _, _, rows in pool.batches] == [3, 3, 1]
+    assert pool.batches[0][:2] == ('parsed_data', ('user_id', 'content'))
+    assert writer.snapshot()["written"] == 7
+    assert REGISTRY.get_sample_value('parser_stage_seconds_count', {'stage': 'db_insert'}) == inserts_before + 3
+
+def test_batch_writer_sync_durability_reports_failures():
+    pool = FakeCopyPool(fail=True)
+
+    async def run():
+        writer = BatchWriter(pool, flush_interval=0, durability='sync', retries=2, retry_delay=0)
+        writer.start()
+        with pytest.raises(ConnectionError):
+            await writer.write('1', '{}')
+        await writer.close()
+        return writer
+
+    writer = asyncio.run(run())
+
+    assert writer.snapshot()["dropped"] == 1
+    assert writer.snapshot()["failed_flushes"] == 2
+
+class FakeDbWriter:
+    def __init__(self):
+        self.rows = []
+
+    async def write(self, user_id, content):
+        self.rows.append((user_id, content))
+
+def _patch_handler(mocker, handler, **state):
+    """Состояние parser_handler без lifespan: HTTP-клиент на MockTransport, БД подменена"""
+    for name, value in (("product_cache", ProductCache()), ("revalidation_cache", RevalidationCache()),
+                        ("inflight", SingleFlight()), ("host_scheduler", HostScheduler(max_wait=0)),
+                        ("breakers", CircuitBreakers()), ("snapshot_store", None)):
+        mocker.patch.object(parser_handler, name, state.pop(name, value))
+    app_state = parser_handler.app.state
+    app_state.http_client = _mock_async_client(handler)
+    app_state.db_writer = FakeDbWriter()
+    app_state.extractor = None
+
+def _handler_client(mocker, handler, **state):
+    _patch_handler(mocker, handler, **state)
+    return TestClient(parser_handler.app)
+
+def test_parse_batch_reports_partial_failures(mocker):
+    pages = {
+        "ok.example": "<html><body><h1>Test Product</h1><span>$19.99</span></body></html>",
+        "noprice.example": "<html><body><h1>Test Product</h1><div>sold out</div></body></html>",
+    }
+
+    def handler(request):
+        if request.url.host == "slow.example":
+            raise httpx.ReadTimeout("timed out", request=request)
+        if request.url.host in pages:
+            return httpx.Response(200, text=pages[request.url.host])
+        return httpx.Response(503)
+
+    clock = FakeClock()
+    breakers = CircuitBreakers(failure_threshold=1, reset_timeout=60, clock=clock)
+    breakers.record_failure("down.example")
+    client = _handler_client(mocker, handler, breakers=breakers)
+
+    urls = ["http://ok.example/p/1", "http://broken.example/p/1", "http://slow.example/p/1",
+            "http://noprice.example/p/1", "http://down.example/p/1"]
+    response = client.post("/parse/batch", json={"urls": urls, "request_id": "r1", "user_id": "manager", "id": 1})
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [result["url"] for result in results] == urls
+    assert [result["ok"] for result in results] == [True, False, False, False, False]
+    assert results[0]["product_info"]["price"] == "$19.99"
+    assert [result["error"] for result in results[1:4]] == ["http_error", "timeout", "price not found"]
+    assert "down.example is unsupported right now" in results[4]["error"]
+    assert len(parser_handler.app.state.db_writer.rows) == 4
+
+def test_parse_batch_rejects_empty_and_oversized_batches(mocker):
+    client = _handler_client(mocker, lambda request: httpx.Response(503))
+    mocker.patch.dict(parser_handler.BATCH_CONFIG, {"max_urls": 2})
+
+    empty = client.post("/parse/batch", json={"urls": [], "user_id": "manager", "id": 1})
+    oversized = client.post("/parse/batch", json={"urls": ["http://a.example/"] * 3, "user_id": "manager", "id": 1})
+
+    assert empty.status_code == oversized.status_code == 400
+    assert oversized.json()["detail"] == "Too many urls, max 2"
+
+def test_sampled_request_joining_unsampled_fetch_gets_stage_timings(mocker):
+    html = "<html><body><h1>Test Product</h1><span>$19.99</span></body></html>"
+    fetched = asyncio.Event()
+    release = asyncio.Event()
+    calls = []
+
+    async def handler(request):
+        calls.append(request.url)
+        fetched.set()
+        await release.wait()
+        return httpx.Response(200, text=html)
+
+    _patch_handler(mocker, handler)
+
+    def request(request_id):
+        return parser_handler.ParseRequest(url="http://shared.example/p/1", request_id=request_id, user_id="1", id=1)
+
+    async def run():
+        # Парсинг начинает запрос вне выборки, запрос из выборки присоединяется к нему
+        leader = asyncio.create_task(parser_handler.process_parse(request("1"), None))
+        await fetched.wait()
+        follower = asyncio.create_task(parser_handler.process_parse(request("2"), {}))
+        await asyncio.sleep(0.01)
+        release.set()
+        return await leader, await follower
+
+    leader, follower = asyncio.run(run())
+
+    assert len(calls) == 1
+    assert "timings" not in leader
+    assert {'connect', 'ttfb', 'download', 'parse', 'total'} <= follower["timings"].keys()
+    assert follower["product_info"]["price"] == "$19.99"
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import time
+
+from metrics import STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+DURABILITY_MODES = ('async', 'sync')
+
+
+class BatchWriter:
+    """Фоновая пакетная запись результатов парсинга в parsed_data через COPY
+
+    Строки копятся в очереди и сбрасываются одним COPY, когда набралось max_batch
+    строк или прошло flush_interval секунд с первой строки пакета. Очередь ограничена
+    max_pending строками: при заполнении write ждет, пока writer ее разгрузит.
+
+    durability='async' - write возвращается сразу после постановки в очередь
+    (при падении процесса несброшенные строки теряются); 'sync' - write ждет,
+    пока пакет с этой строкой будет записан, и пробрасывает ошибку записи.
+    """
+
+    TABLE = 'parsed_data'
+    COLUMNS = ('user_id', 'content')
+
+    def __init__(self, pool, max_batch=100, flush_interval=0.2, max_pending=10000, durability='async',
+                 retries=3, retry_delay=0.5):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability {durability!r}, expected one of {', '.join(DURABILITY_MODES)}")
+        self.pool = pool
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.durability = durability
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._queue = asyncio.Queue(maxsize=max_pending)
+        self._task = None
+        self._closing = False
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.failed_flushes = 0
+        self.last_flush_ms = 0.0
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Сбрасывает все, что осталось в очереди, и останавливает writer"""
+        if self._task is None:
+            return
+        self._closing = True
+        # Будит writer, который ждет добора пакета до flush_interval
+        await self._queue.put(None)
+        await self._queue.join()
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def write(self, user_id, content):
+        done = asyncio.get_running_loop().create_future() if self.durability == 'sync' else None
+        await self._queue.put(((user_id, content), done))
+        if done is not None:
+            await done
+
+    async def _next_batch(self):
+        batch = []
+        item = await self._queue.get()
+        deadline = time.monotonic() + self.flush_interval
+        while item is not None:
+            batch.append(item)
+            if len(batch) >= self.max_batch:
+                return batch
+            try:
+                item = self._queue.get_nowait()
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = 0 if self._closing else deadline - time.monotonic()
+            if timeout <= 0:
+                return batch
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                return batch
+        self._queue.task_done()
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            if not batch:
+                continue
+            try:
+                error = await self._flush([row for row, _ in batch])
+                for _, done in batch:
+                    if done is not None and not done.done():
+                        if error:
+                            done.set_exception(error)
+                        else:
+                            done.set_result(None)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _flush(self, rows):
+        """Пишет пакет, повторяя при ошибке; возвращает последнюю ошибку, если строки не записаны"""
+        error = None
+        for attempt in range(self.retries):
+            started = time.perf_counter()
+            try:
+                async with self.pool.acquire() as conn:
+                    with STAGE_SECONDS.labels("db_insert").time():
+                        await conn.copy_records_to_table(self.TABLE, records=rows, columns=self.COLUMNS)
+            except Exception as err:
+                error = err
+                self.failed_flushes += 1
+                logger.error(f"Failed to write {len(rows)} rows to {self.TABLE} (attempt {attempt + 1}): {err}")
+                if attempt + 1 < self.retries:
+                    await asyncio.sleep(self.retry_delay * (attempt + 1))
+                continue
+            self.last_flush_ms = round((time.perf_counter() - started) * 1000, 3)
+            self.written += len(rows)
+            self.batches += 1
+            return None
+        self.dropped += len(rows)
+        return error
+
+    def snapshot(self):
+        return {
+            "durability": self.durability,
+            "pending": self._queue.qsize(),
+            "max_pending": self._queue.maxsize,
+            "written": self.written,
+            "batches": self.batches,
+            "avg_batch": round(self.written / self.batches, 1) if self.batches else 0.0,
+            "last_flush_ms": self.last_flush_ms,
+            "failed_flushes": self.failed_flushes,
+            "dropped": self.dropped
+        }
@@ -0,0 +1,175 @@
+"""Скорость и точность парсера на сохраненных страницах магазинов из ProductParser.test()
+
+Корпус лежит в benchmarks/corpus: HTML-файлы и manifest.json с ожидаемыми названием
+и ценой для каждой страницы. Сеть не используется, страница подается прямо в load_html.
+
+Запуск из каталога parser:
+    python benchmarks/bench_corpus.py --backend lxml --repeat 20 --json results.json
+    python benchmarks/bench_corpus.py --compare results.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from html_backends import BACKENDS, resolve_backend  # noqa: E402
+from price_parsing import parse_price  # noqa: E402
+from ProductParser import ProductParser  # noqa: E402
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+
+# Метрики сводки, которые сравниваются между прогонами: имя -> больше значит лучше
+COMPARED = {
+    'pages_per_sec': True,
+    'median_ms': False,
+    'p95_ms': False,
+    'peak_kib_max': False,
+    'name_accuracy': True,
+    'price_accuracy': True,
+}
+
+
+def load_corpus(corpus_dir=CORPUS_DIR):
+    with open(os.path.join(corpus_dir, 'manifest.json'), encoding='utf-8') as f:
+        pages = json.load(f)['pages']
+    for page in pages:
+        with open(os.path.join(corpus_dir, page['file']), encoding='utf-8') as f:
+            page['html'] = f.read()
+    return pages
+
+
+def extract(url, html, backend):
+    parser = ProductParser(url, backend=backend)
+    parser.load_html(html)
+    parser.parse_product_name()
+    parser.parse_product_price()
+    return {'name': parser.product_name, 'price': parser.product_price}
+
+
+def same_name(actual, expected):
+    return ' '.join((actual or '').split()).casefold() == ' '.join(expected.split()).casefold()
+
+
+def same_price(actual, expected):
+    # '$130.00' и '$130' - одна и та же цена: сравниваем сумму и валюту
+    return parse_price(actual or '') == parse_price(expected)
+
+
+def bench_page(page, backend, repeat):
+    extract(page['url'], page['html'], backend)
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = extract(page['url'], page['html'], backend)
+        times.append(time.perf_counter() - started)
+
+    # Память меряется отдельным прогоном: tracemalloc заметно замедляет разбор
+    tracemalloc.start()
+    extract(page['url'], page['html'], backend)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    expected = page['expected']
+    return {
+        'shop': page['shop'],
+        'file': page['file'],
+        'bytes': len(page['html'].encode()),
+        'median_ms': round(statistics.median(times) * 1000, 3),
+        'min_ms': round(min(times) * 1000, 3),
+        'peak_kib': round(peak / 1024, 1),
+        'name': result['name'],
+        'price': result['price'],
+        'name_ok': same_name(result['name'], expected['name']),
+        'price_ok': same_price(result['price'], expected['price']),
+    }
+
+
+def summarize(pages):
+    medians = sorted(page['median_ms'] for page in pages)
+    total_seconds = sum(medians) / 1000
+    return {
+        'pages': len(pages),
+        'pages_per_sec': round(len(pages) / total_seconds, 1) if total_seconds else 0.0,
+        'median_ms': round(statistics.median(medians), 3),
+        'p95_ms': round(medians[min(len(medians) - 1, int(len(medians) * 0.95))], 3),
+        'peak_kib_max': max(page['peak_kib'] for page in pages),
+        'name_accuracy': round(sum(page['name_ok'] for page in pages) / len(pages), 3),
+        'price_accuracy': round(sum(page['price_ok'] for page in pages) / len(pages), 3),
+    }
+
+
+def run(backends, repeat, corpus_dir=CORPUS_DIR):
+    corpus = load_corpus(corpus_dir)
+    results = {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': repeat,
+            'corpus_pages': len(corpus),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'backends': {},
+    }
+    for backend in backends:
+        pages = [bench_page(page, backend, repeat) for page in corpus]
+        results['backends'][backend] = {'summary': summarize(pages), 'pages': pages}
+    return results
+
+
+def print_results(results):
+    for backend, data in results['backends'].items():
+        print(f"== {backend}")
+        for page in data['pages']:
+            marks = ('name' if page['name_ok'] else 'NAME') + ' ' + ('price' if page['price_ok'] else 'PRICE')
+            print(f"  {page['shop']:<30} {page['median_ms']:8.3f} ms {page['peak_kib']:8.1f} KiB  {marks}")
+        summary = data['summary']
+        print(f"  {'pages/sec':<30} {summary['pages_per_sec']:8.1f}")
+        print(f"  {'median / p95':<30} {summary['median_ms']:8.3f} / {summary['p95_ms']:.3f} ms")
+        print(f"  {'accuracy name / price':<30} {summary['name_accuracy']:8.3f} / {summary['price_accuracy']:.3f}")
+
+
+def compare(results, baseline):
+    """Печатает изменение метрик сводки относительно предыдущего прогона"""
+    for backend, data in results['backends'].items():
+        if backend not in baseline['backends']:
+            continue
+        old = baseline['backends'][backend]['summary']
+        print(f"== {backend} vs baseline")
+        for metric, higher_is_better in COMPARED.items():
+            before, after = old[metric], data['summary'][metric]
+            change = (after - before) / before * 100 if before else 0.0
+            better = (change > 0) == higher_is_better
+            verdict = '' if abs(change) < 5 else ('better' if better else 'WORSE')
+            print(f"  {metric:<16} {before:10} -> {after:<10} {change:+7.1f}% {verdict}")
+
+
+def available_backends():
+    return [backend for backend in BACKENDS if resolve_backend(backend) == backend]
+
+
+if __name__ == "__main__":
+    args = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    args.add_argument('--backend', action='append', choices=BACKENDS,
+                      help='парсер HTML, можно несколько; по умолчанию все установленные')
+    args.add_argument('--repeat', type=int, default=10)
+    args.add_argument('--corpus', default=CORPUS_DIR)
+    args.add_argument('--json', help='сохранить результаты в файл')
+    args.add_argument('--compare', help='JSON предыдущего прогона для сравнения')
+    options = args.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    results = run(options.backend or available_backends(), options.repeat, options.corpus)
+    print_results(results)
+    if options.compare:
+        with open(options.compare, encoding='utf-8') as f:
+            compare(results, json.load(f))
+    if options.json:
+        with open(options.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,76 @@
+"""Разбор в event loop против пула процессов ProcessPoolExtractor на корпусе страниц
+
+Имитирует нагрузку сервиса: много одновременных разборов внутри одного event loop.
+Запуск из каталога parser: python benchmarks/bench_extraction.py --workers 4 --pages 400
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_corpus import load_corpus  # noqa: E402
+from extraction import ProcessPoolExtractor, extract_product_info  # noqa: E402
+
+
+async def in_loop(pages, backend):
+    async def one(page):
+        return extract_product_info(page['body'], 'utf-8', page['url'], backend)
+    return await asyncio.gather(*(one(page) for page in pages))
+
+
+async def in_pool(pages, backend, extractor):
+    return await asyncio.gather(*(extractor.extract(page['body'], 'utf-8', page['url'], backend) for page in pages))
+
+
+async def loop_lag(work):
+    """Максимальная задержка тика event loop, пока идет разбор"""
+    lag = 0.0
+    done = False
+
+    async def probe():
+        nonlocal lag
+        while not done:
+            started = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lag = max(lag, time.perf_counter() - started - 0.001)
+
+    task = asyncio.create_task(probe())
+    await asyncio.sleep(0)
+    started = time.perf_counter()
+    await work
+    elapsed = time.perf_counter() - started
+    done = True
+    await task
+    return elapsed, lag
+
+
+if __name__ == "__main__":
+    args = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    args.add_argument('--workers', type=int, default=os.cpu_count())
+    args.add_argument('--pages', type=int, default=200)
+    args.add_argument('--backend', default='html.parser')
+    options = args.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    corpus = load_corpus()
+    for page in corpus:
+        page['body'] = page['html'].encode()
+    pages = [corpus[i % len(corpus)] for i in range(options.pages)]
+
+    extractor = ProcessPoolExtractor(options.workers)
+    extractor.start()
+    try:
+        asyncio.run(in_pool(pages[:options.workers], options.backend, extractor))
+        results = {
+            'event loop': asyncio.run(loop_lag(in_loop(pages, options.backend))),
+            f'process pool x{options.workers}': asyncio.run(loop_lag(in_pool(pages, options.backend, extractor))),
+        }
+    finally:
+        extractor.close()
+
+    for name, (elapsed, lag) in results.items():
+        print(f"{name:<20} {len(pages) / elapsed:10.1f} pages/sec   max loop lag {lag * 1000:8.1f} ms")
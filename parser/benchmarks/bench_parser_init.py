@@ -0,0 +1,41 @@
+"""Стоимость создания ProductParser: UserAgent() на каждый парсер против общего пула user_agents
+
+Запуск из каталога parser: python benchmarks/bench_parser_init.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_useragent import UserAgent  # noqa: E402
+
+from ProductParser import ProductParser  # noqa: E402
+from user_agents import default_provider  # noqa: E402
+
+URL = "https://kith.com/collections/mens-footwear/products/aaih3432"
+
+
+def per_call_ms(func, number):
+    started = time.perf_counter()
+    for _ in range(number):
+        func()
+    return (time.perf_counter() - started) / number * 1000
+
+
+def legacy_init():
+    # Что делал ProductParser.__init__ раньше
+    return {'User-Agent': UserAgent().random}
+
+
+if __name__ == "__main__":
+    started = time.perf_counter()
+    default_provider.load()
+    print(f"{'provider load (once)':<28} {(time.perf_counter() - started) * 1000:10.3f} ms")
+
+    legacy = per_call_ms(legacy_init, 50)
+    # User-Agent выбирается лениво, при первом обращении к headers
+    current = per_call_ms(lambda: ProductParser(URL).headers, 5000)
+    print(f"{'legacy ProductParser()':<28} {legacy:10.3f} ms")
+    print(f"{'ProductParser().headers, pool':<28} {current:10.3f} ms")
+    print(f"{'speedup':<28} {legacy / current:10.1f}x")
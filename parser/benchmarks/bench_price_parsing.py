@@ -0,0 +1,62 @@
+"""Микробенчмарк разбора цен: прежние регулярки, собираемые на каждый вызов, против price_parsing
+
+Запуск из каталога parser: python benchmarks/bench_price_parsing.py
+"""
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from price_parsing import extract_display_price, has_currency_symbol, is_price, parse_price  # noqa: E402
+
+SAMPLES = ["Price: $ 1,234.56", "19,99 €", "£110.00", "12000 руб.", "Sale -30% now 1.299,00 €", "In stock"]
+NUMBER = 20000
+
+
+def legacy_display_price(text):
+    currency_symbols = r'[£$€¥₹]'
+    if not (lambda t: re.search(currency_symbols, t) if t else False)(text):
+        return None
+    text = re.sub(r'[^\d\.,£$€¥₹]', '', text)
+    text = re.sub(r'\s+', '', text)
+    match = re.search(rf'({currency_symbols}\d{{1,3}}(,\d{{3}})*(\.\d+)?|\d{{1,3}}(,\d{{3}})*(\.\d+)?\s*{currency_symbols})', text)
+    return match.group(0) if match else None
+
+
+def legacy_is_price(text):
+    pattern = re.compile(r"(\$|€|£|USD|EUR|GBP|CNY|元|руб|RUB)?\s*([\d.,]+)\s*(\$|€|£|USD|EUR|GBP|CNY|元|руб|RUB)?", re.IGNORECASE)
+    return bool(pattern.fullmatch(text.strip()))
+
+
+def legacy_parse_price(text):
+    m = re.search(r"(\$|€|¥|£|USD|EUR|GBP|JPY|CNY|元|руб|RUB)?\s*([\d.,]+)\s*(\$|€|¥|£|USD|EUR|GBP|JPY|CNY|元|руб|RUB)?", text.strip(), re.IGNORECASE)
+    if not m:
+        return None
+    try:
+        return float(m.group(2).replace(",", ".")), (m.group(1) or m.group(3) or "USD").upper()
+    except ValueError:
+        return None
+
+
+def new_display_price(text):
+    return extract_display_price(text) if has_currency_symbol(text) else None
+
+
+def bench(label, func):
+    seconds = timeit.timeit(lambda: [func(sample) for sample in SAMPLES], number=NUMBER)
+    per_call_us = seconds / (NUMBER * len(SAMPLES)) * 1e6
+    print(f"{label:<28} {per_call_us:8.2f} us/call")
+    return per_call_us
+
+
+if __name__ == "__main__":
+    for name, legacy, new in [
+        ("display price (parser)", legacy_display_price, new_display_price),
+        ("is_price (user_bot)", legacy_is_price, is_price),
+        ("parse_price (user_bot)", legacy_parse_price, lambda t: parse_price(t, "USD")),
+    ]:
+        old = bench(f"legacy {name}", legacy)
+        cur = bench(f"new {name}", new)
+        print(f"{'speedup':<28} {old / cur:8.2f}x\n")
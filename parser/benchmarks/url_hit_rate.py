@@ -0,0 +1,64 @@
+"""Сколько повторов ссылок видит кэш при разных способах канонизации
+
+Читает историю запросов: логи parser_handler (строки "Processing URL: ...")
+или файл со ссылкой на строку. Считает число уникальных ключей и долю запросов,
+которые могли бы быть обслужены кэшем (повторы ключа), для сырых ссылок,
+для базовой канонизации (без правил сайтов) и для канонизации с DOMAIN_RULES.
+
+Запуск из каталога parser:
+    docker compose logs parser | python benchmarks/url_hit_rate.py
+    python benchmarks/url_hit_rate.py urls.txt --top 10
+"""
+import argparse
+import fileinput
+import os
+import re
+import sys
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from url_utils import DOMAIN_RULES, canonical_url, registrable_domain  # noqa: E402
+
+LOG_URL = re.compile(r"Processing URL: (\S+)")
+BARE_URL = re.compile(r"^(https?://\S+)$")
+
+STRATEGIES = {
+    'raw': lambda url: url,
+    'basic': lambda url: canonical_url(url, domain_rules={}),
+    'domain rules': canonical_url,
+}
+
+
+def read_urls(lines):
+    for line in lines:
+        match = LOG_URL.search(line) or BARE_URL.match(line.strip())
+        if match:
+            yield match.group(1)
+
+
+def hit_rate(urls, key):
+    keys = Counter(key(url) for url in urls)
+    return len(keys), (len(urls) - len(keys)) / len(urls) if urls else 0.0
+
+
+if __name__ == "__main__":
+    args = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    args.add_argument('files', nargs='*', help='логи или списки ссылок; по умолчанию stdin')
+    args.add_argument('--top', type=int, default=0, help='показать домены с наибольшим выигрышем')
+    options = args.parse_args()
+
+    urls = list(read_urls(fileinput.input(options.files, encoding='utf-8')))
+    print(f"{'requests':<14} {len(urls):>8}")
+    for name, key in STRATEGIES.items():
+        unique, rate = hit_rate(urls, key)
+        print(f"{name:<14} {unique:>8} unique keys   hit rate {rate:6.1%}")
+
+    if options.top:
+        gains = Counter()
+        for domain in {registrable_domain(url) for url in urls}:
+            domain_urls = [url for url in urls if registrable_domain(url) == domain]
+            gains[domain] = hit_rate(domain_urls, canonical_url)[1] - hit_rate(domain_urls, STRATEGIES['raw'])[1]
+        print(f"\ndomains with the biggest gain (rules for {len(DOMAIN_RULES)} domains):")
+        for domain, gain in gains.most_common(options.top):
+            print(f"  {domain:<30} {gain:+7.1%}")
@@ -0,0 +1,120 @@
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    """Домен сейчас считается неподдерживаемым, запрос не отправляется"""
+
+    def __init__(self, domain, retry_after):
+        super().__init__(f"{domain} is unsupported right now, retry in {retry_after:.0f}s")
+        self.domain = domain
+        self.retry_after = retry_after
+
+
+class DomainCircuit:
+    def __init__(self, reset_timeout):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.reset_timeout = reset_timeout
+        self.probing = False
+        self.probe_started = None
+        self.rejected = 0
+        self.last_error = None
+
+
+class CircuitBreakers:
+    """Circuit breaker на каждый регистрируемый домен
+
+    После failure_threshold неудач подряд (ошибка загрузки или не найдены название
+    и цена) домен открывается и запросы к нему сразу отклоняются с CircuitOpen.
+    Через reset_timeout секунд пропускается один пробный запрос (half-open):
+    успех закрывает цепь, неудача снова открывает ее с удвоенным ожиданием,
+    но не дольше max_reset_timeout.
+
+    Результаты передаются вместе с started - временем начала запроса по clock.
+    Запросы, начатые до открытия цепи, на открытую цепь не влияют: иначе под
+    нагрузкой их запоздалые успехи закрывали бы ее раньше пробы. Проба, которая
+    не вернула результат за reset_timeout, уступает место следующей.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=60.0, max_reset_timeout=900.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.clock = clock
+        self._circuits = {}
+
+    def _circuit(self, domain):
+        circuit = self._circuits.get(domain)
+        if circuit is None:
+            circuit = self._circuits[domain] = DomainCircuit(self.reset_timeout)
+        return circuit
+
+    def _retry_after(self, circuit, now):
+        return max(0.0, circuit.opened_at + circuit.reset_timeout - now)
+
+    def check(self, domain):
+        """Бросает CircuitOpen, если запрос к домену сейчас отправлять не нужно"""
+        circuit = self._circuits.get(domain)
+        if circuit is None or circuit.state == CLOSED:
+            return
+        now = self.clock()
+        if circuit.state == OPEN and self._retry_after(circuit, now) <= 0:
+            circuit.state = HALF_OPEN
+        if circuit.state == HALF_OPEN and (not circuit.probing or now - circuit.probe_started >= circuit.reset_timeout):
+            circuit.probing = True
+            circuit.probe_started = now
+            return
+        circuit.rejected += 1
+        raise CircuitOpen(domain, self._retry_after(circuit, now))
+
+    @staticmethod
+    def _is_probe(circuit, started):
+        """Результат пробы half-open: запрос начат уже после открытия цепи"""
+        return circuit.state == HALF_OPEN and started is not None and started >= circuit.opened_at
+
+    def record_success(self, domain, started=None):
+        circuit = self._circuits.get(domain)
+        if circuit is None:
+            return
+        if circuit.state == CLOSED or self._is_probe(circuit, started):
+            del self._circuits[domain]
+
+    def record_failure(self, domain, error=None, started=None):
+        circuit = self._circuit(domain)
+        circuit.failures += 1
+        circuit.last_error = error
+        if self._is_probe(circuit, started):
+            circuit.reset_timeout = min(self.max_reset_timeout, circuit.reset_timeout * 2)
+            self._open(circuit)
+        elif circuit.state == CLOSED and circuit.failures >= self.failure_threshold:
+            self._open(circuit)
+
+    def release(self, domain, started=None):
+        """Запрос закончился без результата для домена (например, сработал наш лимит): проба освобождается"""
+        circuit = self._circuits.get(domain)
+        if circuit is not None and self._is_probe(circuit, started):
+            circuit.probing = False
+
+    def _open(self, circuit):
+        circuit.state = OPEN
+        circuit.opened_at = self.clock()
+        circuit.probing = False
+
+    def snapshot(self):
+        now = self.clock()
+        return {
+            domain: {
+                "state": circuit.state,
+                "failures": circuit.failures,
+                "retry_after": round(self._retry_after(circuit, now), 1) if circuit.opened_at is not None else 0.0,
+                "reset_timeout": circuit.reset_timeout,
+                "rejected": circuit.rejected,
+                "last_error": circuit.last_error
+            }
+            for domain, circuit in self._circuits.items()
+        }
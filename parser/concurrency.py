@@ -0,0 +1,35 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+
+class HostLimiter:
+    """Ограничивает число одновременных запросов: общее и на каждый хост"""
+
+    def __init__(self, global_limit=50, per_host_limit=4):
+        self.global_limit = global_limit
+        self.per_host_limit = per_host_limit
+        self._global = asyncio.Semaphore(global_limit)
+        self._hosts = {}
+
+    @asynccontextmanager
+    async def limit(self, host):
+        host = (host or "").lower()
+        entry = self._hosts.get(host)
+        if entry is None:
+            entry = self._hosts[host] = [asyncio.Semaphore(self.per_host_limit), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._global:
+                    yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._hosts[host]
+
+    def snapshot(self):
+        return {
+            "global_limit": self.global_limit,
+            "per_host_limit": self.per_host_limit,
+            "hosts": {host: users for host, (_, users) in self._hosts.items()}
+        }
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+from contextlib import asynccontextmanager
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограммы ожидания соединения, в секундах
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class PoolWaitStats:
+    """Статистика ожидания свободного соединения в пуле"""
+
+    def __init__(self, buckets=WAIT_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.acquired = 0
+        self.waiting = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def observe(self, wait):
+        self.acquired += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.bucket_counts[bisect_left(self.buckets, wait)] += 1
+
+    def snapshot(self):
+        histogram = {f"le_{bound}": count for bound, count in zip(self.buckets, self.bucket_counts)}
+        histogram["le_inf"] = self.bucket_counts[-1]
+        return {
+            "acquired": self.acquired,
+            "waiting": self.waiting,
+            "avg_wait_ms": round(self.total_wait / self.acquired * 1000, 3) if self.acquired else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 3),
+            "wait_histogram": histogram
+        }
+
+
+class DatabasePool:
+    """Общий пул соединений asyncpg с учетом времени ожидания соединения"""
+
+    def __init__(self, db_config, min_size=2, max_size=10, statement_cache_size=100,
+                 max_inactive_connection_lifetime=300.0):
+        self.db_config = db_config
+        self.min_size = min_size
+        self.max_size = max_size
+        self.statement_cache_size = statement_cache_size
+        self.max_inactive_connection_lifetime = max_inactive_connection_lifetime
+        self.stats = PoolWaitStats()
+        self._pool = None
+        self._lock = asyncio.Lock()
+
+    async def open(self):
+        """Создает пул; при недоступной БД повторит попытку при первом запросе"""
+        try:
+            await self._get_pool()
+        except Exception as err:
+            logger.error(f"Cannot create DB pool at startup: {err}")
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def _get_pool(self):
+        if self._pool is None:
+            async with self._lock:
+                if self._pool is None:
+                    self._pool = await asyncpg.create_pool(
+                        **self.db_config,
+                        min_size=self.min_size,
+                        max_size=self.max_size,
+                        statement_cache_size=self.statement_cache_size,
+                        max_inactive_connection_lifetime=self.max_inactive_connection_lifetime
+                    )
+        return self._pool
+
+    @asynccontextmanager
+    async def acquire(self):
+        pool = await self._get_pool()
+        self.stats.waiting += 1
+        started = time.perf_counter()
+        try:
+            conn = await pool.acquire()
+        finally:
+            self.stats.waiting -= 1
+        self.stats.observe(time.perf_counter() - started)
+        try:
+            yield conn
+        finally:
+            await pool.release(conn)
+
+    def snapshot(self):
+        data = {
+            "min_size": self.min_size,
+            "max_size": self.max_size,
+            "size": self._pool.get_size() if self._pool else 0,
+            "idle": self._pool.get_idle_size() if self._pool else 0
+        }
+        data.update(self.stats.snapshot())
+        return data
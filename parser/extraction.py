@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from ProductParser import ProductParser
+
+
+def extract_product_info(body, encoding, url, backend):
+    """Разбор страницы в процессе-воркере: на вход байты тела, на выход только {'name', 'price', 'price_source'}"""
+    parser = ProductParser(url, backend=backend)
+    parser.load_html(body.decode(encoding or 'utf-8', errors='replace'))
+    parser.parse_product_name()
+    parser.parse_product_price()
+    return {'name': parser.product_name, 'price': parser.product_price, 'price_source': parser.price_source}
+
+
+def _warm_up():
+    # Процесс поднимается и импортирует парсер до первого настоящего запроса
+    return True
+
+
+class ProcessPoolExtractor:
+    """Выносит построение дерева HTML и поиск цены в пул процессов
+
+    Загрузка страниц остается асинхронной в основном процессе, а CPU-работа
+    по разбору распределяется по ядрам и не блокирует event loop.
+    Процессы создаются через spawn: fork процесса с работающим event loop и потоками небезопасен.
+    Если воркер умер (OOM, падение в lxml/lexbor), пул пересоздается, а extract
+    пробрасывает BrokenProcessPool, чтобы вызывающий разобрал страницу у себя.
+    """
+
+    def __init__(self, workers, max_tasks_per_child=None):
+        self.workers = workers
+        self.max_tasks_per_child = max_tasks_per_child
+        self._pool = None
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.restarts = 0
+        self.busy_seconds = 0.0
+
+    def start(self):
+        self._pool = self._create_pool()
+
+    def _create_pool(self):
+        pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            max_tasks_per_child=self.max_tasks_per_child
+        )
+        for _ in range(self.workers):
+            pool.submit(_warm_up)
+        return pool
+
+    def _restart(self, broken):
+        # Одновременные запросы получают BrokenProcessPool от одного и того же пула: пересоздаем его один раз
+        if self._pool is not broken:
+            return
+        logging.warning(f"Extraction pool is broken, starting {self.workers} new workers")
+        broken.shutdown(wait=False, cancel_futures=True)
+        self._pool = self._create_pool()
+        self.restarts += 1
+
+    def close(self):
+        if self._pool:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    async def extract(self, body, encoding, url, backend):
+        self.submitted += 1
+        started = time.perf_counter()
+        pool = self._pool
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(
+                pool, extract_product_info, body, encoding, url, backend
+            )
+        except BrokenProcessPool:
+            self.failed += 1
+            self._restart(pool)
+            raise
+        except Exception as e:
+            self.failed += 1
+            logging.error(f"Extraction worker failed on {url}: {e}")
+            raise
+        self.completed += 1
+        self.busy_seconds += time.perf_counter() - started
+        return result
+
+    def snapshot(self):
+        return {
+            "workers": self.workers,
+            "submitted": self.submitted,
+            "in_flight": self.submitted - self.completed - self.failed,
+            "completed": self.completed,
+            "failed": self.failed,
+            "restarts": self.restarts,
+            "avg_ms": round(self.busy_seconds / self.completed * 1000, 3) if self.completed else 0.0
+        }
@@ -0,0 +1,145 @@
+import asyncio
+import time
+from email.utils import parsedate_to_datetime
+
+THROTTLE_STATUSES = {429, 503}
+
+
+class HostThrottled(Exception):
+    """Хост попросил подождать дольше, чем мы готовы ждать"""
+
+
+def parse_retry_after(value, now=None):
+    """Retry-After в секундах: поддерживает и число, и HTTP-дату"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    now = time.time() if now is None else now
+    return max(0.0, retry_at.timestamp() - now)
+
+
+class HostBucket:
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.tokens = float(burst)
+        self.updated = now
+        self.blocked_until = 0.0
+        self.waiting = 0
+        self.throttled = 0
+
+
+class HostScheduler:
+    """Token bucket на каждый хост с адаптивной скоростью
+
+    Каждый хост получает rate запросов в секунду с запасом burst. Ответы 429/503
+    и таймауты уменьшают скорость в backoff раз (не ниже min_rate), Retry-After
+    блокирует хост на указанное время. Успешные ответы постепенно возвращают
+    скорость к исходной, прибавляя recovery * rate за ответ.
+
+    acquire резервирует токен сразу (токены уходят в минус) и спит, пока долг
+    не погасится, поэтому ожидание учитывает всех, кто встал в очередь раньше.
+    Если ждать пришлось бы дольше max_wait, acquire бросает HostThrottled
+    до ожидания вместо того, чтобы держать запрос до таймаута.
+    """
+
+    def __init__(self, rate=2.0, burst=4, min_rate=0.1, backoff=0.5, recovery=0.1, max_wait=10.0,
+                 max_hosts=1000, clock=time.monotonic, sleep=asyncio.sleep):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.backoff = backoff
+        self.recovery = recovery
+        self.max_wait = max_wait
+        self.max_hosts = max_hosts
+        self.clock = clock
+        self.sleep = sleep
+        self._buckets = {}
+
+    def _bucket(self, host):
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            if len(self._buckets) >= self.max_hosts:
+                self._prune()
+            bucket = self._buckets[host] = HostBucket(self.rate, self.burst, self.clock())
+        return bucket
+
+    def _prune(self):
+        now = self.clock()
+        for host, bucket in list(self._buckets.items()):
+            self._refill(bucket, now)
+            if not bucket.waiting and bucket.rate >= self.rate and bucket.tokens >= self.burst and bucket.blocked_until <= now:
+                del self._buckets[host]
+
+    def _refill(self, bucket, now):
+        bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * bucket.rate)
+        bucket.updated = now
+
+    def _wait_time(self, bucket, now):
+        # Токены копятся и во время блокировки по Retry-After, поэтому берется большее из двух ожиданий
+        debt = max(0.0, (1 - bucket.tokens) / bucket.rate)
+        return max(debt, bucket.blocked_until - now)
+
+    async def acquire(self, host):
+        bucket = self._bucket(host)
+        now = self.clock()
+        self._refill(bucket, now)
+        wait = self._wait_time(bucket, now)
+        if wait > self.max_wait:
+            raise HostThrottled(f"{host} is throttled for another {wait:.1f}s")
+        bucket.tokens -= 1
+        if wait <= 0:
+            return
+        bucket.waiting += 1
+        try:
+            await self.sleep(wait)
+            # Пока ждали, хост мог прислать новый Retry-After
+            blocked = bucket.blocked_until - self.clock()
+            if blocked > self.max_wait:
+                raise HostThrottled(f"{host} is throttled for another {blocked:.1f}s")
+            if blocked > 0:
+                await self.sleep(blocked)
+        except BaseException:
+            # Запрос так и не ушел (отказ или отмена): возвращаем токен, чтобы его долг не задерживал остальных
+            bucket.tokens += 1
+            raise
+        finally:
+            bucket.waiting -= 1
+
+    def record(self, host, status, retry_after=None):
+        bucket = self._bucket(host)
+        now = self.clock()
+        if status in THROTTLE_STATUSES:
+            self._slow_down(bucket, now)
+            delay = parse_retry_after(retry_after)
+            if delay:
+                bucket.blocked_until = max(bucket.blocked_until, now + delay)
+        else:
+            bucket.rate = min(self.rate, bucket.rate + self.recovery * self.rate)
+
+    def record_failure(self, host):
+        """Таймауты и обрывы соединения считаем признаком блокировки"""
+        self._slow_down(self._bucket(host), self.clock())
+
+    def _slow_down(self, bucket, now):
+        self._refill(bucket, now)
+        bucket.rate = max(self.min_rate, bucket.rate * self.backoff)
+        bucket.tokens = min(bucket.tokens, 0.0)
+        bucket.throttled += 1
+
+    def snapshot(self):
+        now = self.clock()
+        return {
+            host: {
+                "queue_depth": bucket.waiting,
+                "rate": round(bucket.rate, 3),
+                "blocked_for": round(max(0.0, bucket.blocked_until - now), 3),
+                "throttled": bucket.throttled
+            }
+            for host, bucket in self._buckets.items()
+        }
@@ -0,0 +1,161 @@
+import logging
+import os
+
+from bs4 import BeautifulSoup, Tag
+
+try:
+    import lxml  # noqa: F401
+except ImportError:
+    lxml = None
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+BACKENDS = ('html.parser', 'lxml', 'selectolax')
+
+# BeautifulSoup не включает текст этих тегов в get_text(), повторяем это для lexbor
+SKIPPED_TEXT_TAGS = {'script', 'style', 'template'}
+
+
+class SoupDocument:
+    """Доступ к дереву BeautifulSoup (html.parser или lxml) для эвристик парсера"""
+
+    def __init__(self, soup):
+        self.soup = soup
+
+    def elements(self):
+        """Все теги в порядке документа: (узел, имя тега, список классов, атрибуты)"""
+        for node in self.soup.descendants:
+            if isinstance(node, Tag):
+                yield node, node.name, node.get('class'), node.attrs
+
+    def string(self, node):
+        return node.string
+
+    def text(self, node):
+        return node.get_text(strip=True)
+
+
+class LexborDocument:
+    """То же самое поверх selectolax/lexbor, без построения дерева BeautifulSoup"""
+
+    def __init__(self, tree):
+        self.tree = tree
+
+    def elements(self):
+        for node in self.tree.root.traverse():
+            tag = node.tag
+            if tag.startswith('-'):
+                continue
+            attrs = node.attributes
+            classes = attrs.get('class')
+            yield node, tag, classes.split() if classes else None, attrs
+
+    def string(self, node):
+        # Аналог Tag.string: текст единственного потомка, иначе None
+        children = list(node.iter(include_text=True))
+        if len(children) != 1:
+            return None
+        child = children[0]
+        if child.tag == '-text':
+            return child.text_content
+        if child.tag.startswith('-'):
+            return None
+        return self.string(child)
+
+    def text(self, node):
+        parts = []
+        for child in node.iter(include_text=True):
+            if child.tag == '-text':
+                text = (child.text_content or "").strip()
+                if text:
+                    parts.append(text)
+            elif not child.tag.startswith('-') and child.tag not in SKIPPED_TEXT_TAGS:
+                parts.append(self.text(child))
+        return ''.join(parts)
+
+
+class PageScan:
+    """Кандидаты, собранные за один проход по документу
+
+    tags/classes хранят первый узел для каждого искомого тега и класса, price_node -
+    первый span с ценой. JSON-LD и мета-теги собираются в том же проходе, поэтому
+    скан можно передавать прямо в extract_structured_data.
+    """
+
+    def __init__(self, document):
+        self.document = document
+        self.tags = {}
+        self.classes = {}
+        self.price_node = None
+        self.json_ld = []
+        self.meta_property = {}
+        self.meta_name = {}
+
+    def text(self, node):
+        return self.document.text(node)
+
+    def json_ld_texts(self):
+        return self.json_ld
+
+    def meta_content(self, key):
+        if key in self.meta_property:
+            return self.meta_property[key]
+        return self.meta_name.get(key)
+
+
+def scan_document(document, name_tags, name_classes, price_predicate):
+    scan = PageScan(document)
+    name_tags = set(name_tags)
+    name_classes = set(name_classes)
+    for node, tag, classes, attrs in document.elements():
+        if tag in name_tags and tag not in scan.tags:
+            scan.tags[tag] = node
+        if classes:
+            for cls in classes:
+                if cls in name_classes and cls not in scan.classes:
+                    scan.classes[cls] = node
+        if tag == 'span':
+            if scan.price_node is None and price_predicate(document.string(node)):
+                scan.price_node = node
+        elif tag == 'meta':
+            prop = attrs.get('property')
+            if prop is not None and prop not in scan.meta_property:
+                scan.meta_property[prop] = attrs.get('content')
+            name = attrs.get('name')
+            if name is not None and name not in scan.meta_name:
+                scan.meta_name[name] = attrs.get('content')
+        elif tag == 'script' and attrs.get('type') == 'application/ld+json':
+            scan.json_ld.append(document.string(node) or "")
+    return scan
+
+
+def resolve_backend(name):
+    """Возвращает доступный бэкенд; при отсутствии зависимости откатывается на html.parser"""
+    if name not in BACKENDS:
+        logging.warning(f"Unknown HTML parser backend {name!r}, using html.parser.")
+        return 'html.parser'
+    if name == 'lxml' and lxml is None:
+        logging.warning("lxml is not installed, using html.parser.")
+        return 'html.parser'
+    if name == 'selectolax' and LexborHTMLParser is None:
+        logging.warning("selectolax is not installed, using html.parser.")
+        return 'html.parser'
+    return name
+
+
+DEFAULT_BACKEND = resolve_backend(os.getenv("HTML_PARSER_BACKEND", "html.parser"))
+
+
+def parse_html(html, backend=DEFAULT_BACKEND):
+    if backend == 'selectolax':
+        return LexborHTMLParser(html)
+    return BeautifulSoup(html, backend)
+
+
+def as_document(parsed):
+    if isinstance(parsed, BeautifulSoup):
+        return SoupDocument(parsed)
+    return LexborDocument(parsed)
@@ -0,0 +1,200 @@
+import asyncio
+import ipaddress
+import logging
+import socket
+import time
+
+import httpcore
+import httpx
+
+from singleflight import SingleFlight
+
+try:
+    import h2
+except ImportError:
+    h2 = None
+
+
+class DnsCache:
+    """Кэш DNS внутри процесса: адреса хоста живут ttl секунд
+
+    getaddrinfo не отдает TTL записи, поэтому срок жизни задается настройкой;
+    держите его не больше TTL у DNS-записей магазинов. Одновременные запросы
+    одного хоста объединяются в одно разрешение имени. IP-адреса не кэшируются.
+    """
+
+    def __init__(self, ttl=60.0, max_entries=1024, clock=time.monotonic, resolver=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self.resolver = resolver or self._getaddrinfo
+        self._entries = {}
+        self._lookups = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+
+    @staticmethod
+    async def _getaddrinfo(host, port):
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        return list(dict.fromkeys(info[4][0] for info in infos))
+
+    @staticmethod
+    def is_ip(host):
+        try:
+            ipaddress.ip_address(host)
+        except ValueError:
+            return False
+        return True
+
+    async def resolve(self, host, port):
+        """Список адресов хоста: из кэша, пока не истек ttl, иначе через resolver"""
+        if self.is_ip(host) or self.ttl <= 0:
+            return [host]
+        entry = self._entries.get(host)
+        if entry is not None and entry[1] > self.clock():
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        try:
+            addresses = await self._lookups.do(host, lambda: self.resolver(host, port))
+        except OSError:
+            self.failures += 1
+            raise
+        self._entries.pop(host, None)
+        self._entries[host] = (addresses, self.clock() + self.ttl)
+        while len(self._entries) > self.max_entries:
+            del self._entries[next(iter(self._entries))]
+        return addresses
+
+    def invalidate(self, host):
+        self._entries.pop(host, None)
+
+    def snapshot(self):
+        lookups = self.hits + self.misses
+        return {
+            "ttl": self.ttl,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "failures": self.failures,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0
+        }
+
+
+class CachingNetworkBackend(httpcore.AsyncNetworkBackend):
+    """Сетевой бэкенд httpcore, который берет адреса из DnsCache и считает открытые соединения
+
+    TLS по-прежнему идет с именем хоста из ссылки (SNI и проверка сертификата
+    делаются в httpcore), сюда приходит только TCP-подключение. Адреса хоста
+    пробуются по очереди в пределах общего timeout; на каждый адрес, кроме
+    последнего, дается не больше attempt_timeout секунд, чтобы недоступный
+    первый адрес (например, IPv6 без маршрута) не съедал весь timeout.
+    """
+
+    def __init__(self, dns, backend=None, attempt_timeout=3.0, clock=time.monotonic):
+        self.dns = dns
+        self.backend = backend or httpcore.AnyIOBackend()
+        self.attempt_timeout = attempt_timeout
+        self.clock = clock
+        self.connections_opened = 0
+
+    def _attempt_timeout(self, deadline, last):
+        if deadline is None:
+            return None if last else self.attempt_timeout
+        remaining = deadline - self.clock()
+        if remaining <= 0:
+            raise httpcore.ConnectTimeout("connect timeout: no time left for the remaining addresses")
+        return remaining if last else min(remaining, self.attempt_timeout)
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        try:
+            addresses = await self.dns.resolve(host, port)
+        except OSError as err:
+            raise httpcore.ConnectError(str(err)) from err
+        deadline = None if timeout is None else self.clock() + timeout
+        error = None
+        for index, address in enumerate(addresses):
+            try:
+                attempt_timeout = self._attempt_timeout(deadline, last=index == len(addresses) - 1)
+                stream = await self.backend.connect_tcp(
+                    address, port, timeout=attempt_timeout, local_address=local_address, socket_options=socket_options
+                )
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as err:
+                error = err
+                continue
+            self.connections_opened += 1
+            return stream
+        # Адреса могли смениться раньше, чем истек ttl: следующая попытка разрешит имя заново
+        self.dns.invalidate(host)
+        raise error
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return await self.backend.connect_unix_socket(path, timeout=timeout, socket_options=socket_options)
+
+    async def sleep(self, seconds):
+        await self.backend.sleep(seconds)
+
+
+class PooledTransport(httpx.AsyncHTTPTransport):
+    """Транспорт httpx с пулом keep-alive соединений по хостам, HTTP/2 и кэшем DNS
+
+    Считает запросы и открытые соединения: reuse_ratio - доля запросов,
+    которые ушли по уже открытому соединению.
+    """
+
+    def __init__(self, limits, http2=True, dns_ttl=60.0, retries=0, backend=None, connect_attempt_timeout=3.0):
+        if http2 and h2 is None:
+            logging.warning("h2 is not installed, falling back to HTTP/1.1")
+            http2 = False
+        super().__init__(limits=limits, http2=http2, retries=retries)
+        self.http2 = http2
+        self.dns = DnsCache(ttl=dns_ttl)
+        self.network = CachingNetworkBackend(self.dns, backend, attempt_timeout=connect_attempt_timeout)
+        self._pool = httpcore.AsyncConnectionPool(
+            ssl_context=httpx.create_ssl_context(),
+            max_connections=limits.max_connections,
+            max_keepalive_connections=limits.max_keepalive_connections,
+            keepalive_expiry=limits.keepalive_expiry,
+            http1=True,
+            http2=http2,
+            retries=retries,
+            network_backend=self.network
+        )
+        self.requests = 0
+        self.http2_responses = 0
+
+    async def handle_async_request(self, request):
+        # Считаются только запросы с ответом: неудачное подключение не должно выглядеть как переиспользование
+        response = await super().handle_async_request(request)
+        self.requests += 1
+        if response.extensions.get('http_version') == b'HTTP/2':
+            self.http2_responses += 1
+        return response
+
+    @property
+    def connections_opened(self):
+        return self.network.connections_opened
+
+    @property
+    def reuse_ratio(self):
+        if not self.requests:
+            return 0.0
+        return max(0.0, 1 - self.connections_opened / self.requests)
+
+    def snapshot(self):
+        return {
+            "http2": self.http2,
+            "requests": self.requests,
+            "connections_opened": self.connections_opened,
+            "reuse_ratio": round(self.reuse_ratio, 3),
+            "http2_responses": self.http2_responses,
+            "dns": self.dns.snapshot()
+        }
+
+
+def create_transport(max_connections=200, max_keepalive_connections=50, keepalive_expiry=30.0, http2=True, dns_ttl=60.0,
+                     connect_attempt_timeout=3.0):
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections,
+                          keepalive_expiry=keepalive_expiry)
+    return PooledTransport(limits, http2=http2, dns_ttl=dns_ttl, connect_attempt_timeout=connect_attempt_timeout)
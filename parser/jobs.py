@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import time
+import uuid
+from urllib.parse import urlsplit
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueueFull(Exception):
+    """Очередь заданий заполнена, новое задание не принято"""
+
+
+class CallbackNotAllowed(Exception):
+    """callback_url не http(s) или его хоста нет в списке разрешенных"""
+
+
+def check_callback_url(url, allowed_hosts):
+    """Пропускает только http(s)-ссылки на хосты из allowed_hosts, чтобы через колбэк нельзя было достучаться до внутренних сервисов"""
+    try:
+        parts = urlsplit(url)
+        host = (parts.hostname or "").lower()
+    except ValueError:
+        raise CallbackNotAllowed(f"Invalid callback_url {url!r}")
+    if parts.scheme not in ("http", "https"):
+        raise CallbackNotAllowed(f"callback_url must be http or https, got {parts.scheme!r}")
+    if host not in allowed_hosts:
+        raise CallbackNotAllowed(f"callback_url host {host!r} is not allowed")
+
+
+class Job:
+    def __init__(self, func, callback_url, now):
+        self.id = uuid.uuid4().hex
+        self.func = func
+        self.callback_url = callback_url
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.callback_status = None
+        self.created_at = now
+        self.finished_at = None
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "callback_status": self.callback_status
+        }
+
+
+class JobQueue:
+    """Фоновые задания парсинга: очередь ограниченного размера и пул воркеров
+
+    submit сразу возвращает задание, воркеры выполняют его func. По завершении
+    вызывается notify(job), если у задания есть callback_url. Завершенные задания
+    хранятся ttl секунд и удаляются при следующем обращении к очереди.
+    callback_url принимается только для хостов из callback_hosts.
+    """
+
+    def __init__(self, workers=8, max_queue=1000, ttl=3600, callback_hosts=(), clock=time.monotonic):
+        self.workers = workers
+        self.ttl = ttl
+        self.callback_hosts = {host.lower() for host in callback_hosts}
+        self.clock = clock
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._jobs = {}
+        self._tasks = []
+        self._notify = None
+        self.completed = 0
+        self.failed = 0
+        self.expired = 0
+
+    def start(self, notify=None):
+        self._notify = notify
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, func, callback_url=None):
+        if callback_url is not None:
+            check_callback_url(callback_url, self.callback_hosts)
+        self._expire()
+        job = Job(func, callback_url, self.clock())
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise JobQueueFull(f"Job queue is full ({self._queue.maxsize} jobs)")
+        self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id):
+        self._expire()
+        return self._jobs.get(job_id)
+
+    def _expire(self):
+        now = self.clock()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished_at is not None and job.finished_at + self.ttl <= now:
+                del self._jobs[job_id]
+                self.expired += 1
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job):
+        job.status = RUNNING
+        try:
+            job.result = await job.func()
+            job.status = DONE
+            self.completed += 1
+        except Exception as e:
+            logging.error(f"Job {job.id} failed: {e}")
+            job.error = str(e)
+            job.status = FAILED
+            self.failed += 1
+        job.func = None
+        job.finished_at = self.clock()
+        if job.callback_url and self._notify:
+            try:
+                job.callback_status = await self._notify(job)
+            except Exception as e:
+                logging.warning(f"Callback for job {job.id} to {job.callback_url} failed: {e}")
+                job.callback_status = "failed"
+
+    async def join(self):
+        await self._queue.join()
+
+    def snapshot(self):
+        statuses = [job.status for job in self._jobs.values()]
+        return {
+            "workers": len(self._tasks),
+            "queued": self._queue.qsize(),
+            "max_queue": self._queue.maxsize,
+            "running": statuses.count(RUNNING),
+            "stored": len(self._jobs),
+            "completed": self.completed,
+            "failed": self.failed,
+            "expired": self.expired
+        }
@@ -0,0 +1,60 @@
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+from site_adapters import ShopifyAdapter
+from url_utils import DOMAIN_RULES, registrable_domain
+
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30)
+
+STAGE_SECONDS = Histogram(
+    'parser_stage_seconds', 'Time spent in each stage of a parse request',
+    ['stage'], buckets=STAGE_BUCKETS
+)
+OUTCOMES = Counter(
+    'parser_outcomes_total', 'Parse results by registrable domain and outcome',
+    ['domain', 'outcome']
+)
+BYTES_DOWNLOADED = Counter(
+    'parser_bytes_downloaded_total', 'Bytes of product pages downloaded, by registrable domain',
+    ['domain']
+)
+# Метка domain берется только из известных магазинов, остальные домены считаются
+# как OTHER_DOMAIN: иначе каждая присланная ссылка добавляла бы новые ряды метрик
+OTHER_DOMAIN = 'other'
+KNOWN_DOMAINS = set(DOMAIN_RULES) | {registrable_domain(f'https://{host}') for host in ShopifyAdapter.HOSTS}
+IN_FLIGHT = Gauge('parser_requests_in_flight', 'Parse requests currently being processed')
+HTTP_REQUESTS = Gauge('parser_http_requests', 'Requests sent through the shared HTTP transport')
+HTTP_CONNECTIONS_OPENED = Gauge('parser_http_connections_opened', 'TCP connections opened by the shared HTTP transport')
+CONNECTION_REUSE = Gauge('parser_http_connection_reuse_ratio', 'Share of requests sent over an already open connection')
+DNS_CACHE_HIT_RATE = Gauge('parser_dns_cache_hit_rate', 'Share of host lookups answered from the DNS cache')
+
+
+def track_domains(domains):
+    """Добавляет домены, которые получат в метриках свою метку"""
+    KNOWN_DOMAINS.update(domain.lower() for domain in domains)
+
+
+def domain_label(domain):
+    return domain if domain in KNOWN_DOMAINS else OTHER_DOMAIN
+
+
+def observe_parser(parser, domain):
+    """Переносит в метрики время этапов, исходы и объем загрузки одного AsyncProductParser"""
+    domain = domain_label(domain)
+    for stage, seconds in parser.timings.items():
+        STAGE_SECONDS.labels(stage).observe(seconds)
+    for outcome in parser.outcomes():
+        OUTCOMES.labels(domain, outcome).inc()
+    if parser.bytes_downloaded:
+        BYTES_DOWNLOADED.labels(domain).inc(parser.bytes_downloaded)
+
+
+def observe_transport(transport):
+    """Значения берутся из PooledTransport в момент сбора метрик"""
+    HTTP_REQUESTS.set_function(lambda: transport.requests)
+    HTTP_CONNECTIONS_OPENED.set_function(lambda: transport.connections_opened)
+    CONNECTION_REUSE.set_function(lambda: transport.reuse_ratio)
+    DNS_CACHE_HIT_RATE.set_function(lambda: transport.dns.snapshot()["hit_rate"])
+
+
+def render():
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -1,13 +1,36 @@
+import asyncio
 import json
 import logging
 import os
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse
-from ProductParser import ProductParser
+from fastapi.responses import JSONResponse, Response
+from ProductParser import AsyncProductParser, create_async_client
+from batch_writer import BatchWriter
+from circuit_breaker import CircuitBreakers, CircuitOpen
+from concurrency import HostLimiter
+from db import DatabasePool
+from extraction import ProcessPoolExtractor
+from host_scheduler import HostScheduler
+from http_transport import create_transport
+from jobs import CallbackNotAllowed, JobQueue, JobQueueFull
+from metrics import (
+    IN_FLIGHT, OUTCOMES, STAGE_SECONDS, domain_label, observe_parser, observe_transport, render as render_metrics,
+    track_domains
+)
+from product_cache import ProductCache
+from request_timing import as_milliseconds, sampled, server_timing
+from revalidation import RevalidationCache
+from singleflight import SingleFlight
+from snapshot_store import SnapshotStore
+from url_utils import canonical_url, registrable_domain
+from user_agents import default_provider as user_agent_provider
 from pydantic import BaseModel
-from typing import Union
+from typing import List, Optional, Tuple, Union
+from urllib.parse import urlsplit
 import uuid
-import asyncpg
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -20,61 +43,384 @@ DB_CONFIG = {
     "port": os.getenv("DB_PORT")
 }
 
-app = FastAPI()
+HTTP_CLIENT_CONFIG = {
+    "timeout": float(os.getenv("HTTP_TIMEOUT", "15"))
+}
+
+HTTP_TRANSPORT_CONFIG = {
+    "max_connections": int(os.getenv("HTTP_MAX_CONNECTIONS", "200")),
+    "max_keepalive_connections": int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "50")),
+    # Сколько секунд простаивающее соединение остается в пуле
+    "keepalive_expiry": float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30")),
+    "http2": os.getenv("HTTP2", "1") == "1",
+    # Сколько секунд живут адреса в кэше DNS, 0 - без кэша
+    "dns_ttl": float(os.getenv("DNS_CACHE_TTL", "60")),
+    # Сколько секунд ждать подключения к одному адресу хоста, прежде чем пробовать следующий
+    "connect_attempt_timeout": float(os.getenv("HTTP_CONNECT_ATTEMPT_TIMEOUT", "3"))
+}
+
+FETCH_CONFIG = {
+    "stream": os.getenv("FETCH_STREAMING", "1") == "1",
+    "max_bytes": int(os.getenv("FETCH_MAX_BYTES", str(2 * 1024 * 1024))),
+    # Останавливать чтение по h1 и span с ценой, не дожидаясь JSON-LD: быстрее, но может взять не ту цену
+    "stream_heuristic": os.getenv("FETCH_STREAM_HEURISTIC", "0") == "1"
+}
+
+# 0 - разбор в основном процессе, иначе число процессов для разбора HTML
+EXTRACT_CONFIG = {
+    "workers": int(os.getenv("EXTRACT_WORKERS", "0")),
+    "max_tasks_per_child": int(os.getenv("EXTRACT_MAX_TASKS_PER_CHILD", "0")) or None
+}
+
+SCHEDULER_CONFIG = {
+    "rate": float(os.getenv("HOST_RATE", "2")),
+    "burst": int(os.getenv("HOST_BURST", "4")),
+    "min_rate": float(os.getenv("HOST_MIN_RATE", "0.1")),
+    "max_wait": float(os.getenv("HOST_MAX_WAIT", "10"))
+}
+
+BREAKER_CONFIG = {
+    "failure_threshold": int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5")),
+    "reset_timeout": float(os.getenv("BREAKER_RESET_TIMEOUT", "60")),
+    "max_reset_timeout": float(os.getenv("BREAKER_MAX_RESET_TIMEOUT", "900"))
+}
+
+SNAPSHOT_CONFIG = {
+    "mode": os.getenv("SNAPSHOT_MODE", "off"),
+    "root": os.getenv("SNAPSHOT_DIR", "snapshots"),
+    "max_bytes": int(os.getenv("SNAPSHOT_MAX_BYTES", str(512 * 1024 * 1024)))
+}
+
+JOB_CONFIG = {
+    "workers": int(os.getenv("JOB_WORKERS", "8")),
+    "max_queue": int(os.getenv("JOB_MAX_QUEUE", "1000")),
+    "ttl": float(os.getenv("JOB_TTL", "3600")),
+    # Хосты, на которые можно отправить callback_url, через запятую; пусто - колбэки запрещены
+    "callback_hosts": [host.strip() for host in os.getenv("JOB_CALLBACK_HOSTS", "").split(",") if host.strip()]
+}
+
+# Домены со своей меткой в /metrics через запятую, вдобавок к магазинам из site_adapters и url_utils
+METRICS_CONFIG = {
+    "domains": [domain.strip() for domain in os.getenv("METRICS_DOMAINS", "").split(",") if domain.strip()]
+}
+
+# Доля запросов /parse, в ответ на которые добавляются Server-Timing и поле timings
+TIMING_CONFIG = {
+    "sample_rate": float(os.getenv("TIMING_SAMPLE_RATE", "0"))
+}
+
+DB_POOL_CONFIG = {
+    "min_size": int(os.getenv("DB_POOL_MIN_SIZE", "2")),
+    "max_size": int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+    "statement_cache_size": int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100")),
+    "max_inactive_connection_lifetime": float(os.getenv("DB_POOL_MAX_IDLE", "300"))
+}
+
+# durability: async - ответ не ждет записи в БД, sync - ждет сброса пакета со своей строкой
+DB_WRITE_CONFIG = {
+    "max_batch": int(os.getenv("DB_WRITE_BATCH_SIZE", "100")),
+    "flush_interval": float(os.getenv("DB_WRITE_FLUSH_MS", "200")) / 1000,
+    "max_pending": int(os.getenv("DB_WRITE_MAX_PENDING", "10000")),
+    "durability": os.getenv("DB_WRITE_DURABILITY", "async")
+}
+
+CACHE_CONFIG = {
+    "ttl": float(os.getenv("CACHE_TTL", "600")),
+    "max_entries": int(os.getenv("CACHE_MAX_ENTRIES", "10000")),
+    "max_bytes": int(os.getenv("CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+}
+
+REVALIDATION_CONFIG = {
+    "ttl": float(os.getenv("REVALIDATION_TTL", "86400")),
+    "max_entries": int(os.getenv("REVALIDATION_MAX_ENTRIES", "50000")),
+    "max_bytes": int(os.getenv("REVALIDATION_MAX_BYTES", str(16 * 1024 * 1024)))
+}
+
+BATCH_CONFIG = {
+    "max_urls": int(os.getenv("BATCH_MAX_URLS", "100")),
+    "global_limit": int(os.getenv("BATCH_GLOBAL_CONCURRENCY", "50")),
+    "per_host_limit": int(os.getenv("BATCH_PER_HOST_CONCURRENCY", "4"))
+}
+
+# Разбивка времени текущего запроса по фазам, если он попал в выборку
+request_timings = ContextVar("request_timings", default=None)
+
+product_cache = ProductCache(**CACHE_CONFIG)
+revalidation_cache = RevalidationCache(**REVALIDATION_CONFIG)
+inflight = SingleFlight()
+batch_limiter = HostLimiter(BATCH_CONFIG["global_limit"], BATCH_CONFIG["per_host_limit"])
+host_scheduler = HostScheduler(**SCHEDULER_CONFIG)
+breakers = CircuitBreakers(**BREAKER_CONFIG)
+job_queue = JobQueue(**JOB_CONFIG)
+track_domains(METRICS_CONFIG["domains"])
+snapshot_store = SnapshotStore(**SNAPSHOT_CONFIG) if SNAPSHOT_CONFIG["mode"] != "off" else None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Создает общий HTTP-клиент, пул соединений к БД, пул процессов разбора и воркеры заданий на время жизни приложения"""
+    user_agent_provider.load()
+    app.state.http_transport = create_transport(**HTTP_TRANSPORT_CONFIG)
+    app.state.http_client = create_async_client(transport=app.state.http_transport, **HTTP_CLIENT_CONFIG)
+    observe_transport(app.state.http_transport)
+    app.state.db_pool = DatabasePool(DB_CONFIG, **DB_POOL_CONFIG)
+    await app.state.db_pool.open()
+    app.state.db_writer = BatchWriter(app.state.db_pool, **DB_WRITE_CONFIG)
+    app.state.db_writer.start()
+    app.state.extractor = ProcessPoolExtractor(**EXTRACT_CONFIG) if EXTRACT_CONFIG["workers"] > 0 else None
+    if app.state.extractor:
+        app.state.extractor.start()
+    job_queue.start(notify_callback)
+    try:
+        yield
+    finally:
+        await job_queue.stop()
+        if app.state.extractor:
+            app.state.extractor.close()
+        await app.state.db_writer.close()
+        await app.state.db_pool.close()
+        await app.state.http_client.aclose()
+
+app = FastAPI(lifespan=lifespan)
 
 class ParseRequest(BaseModel):
     url: str
     request_id: Union[int, str]
     user_id: Union[int, str]
     id: Union[int, str]
+    callback_url: Optional[str] = None
+
+class BatchParseRequest(BaseModel):
+    urls: List[str]
+    request_id: Optional[Union[int, str]] = None
+    user_id: Union[int, str]
+    id: Union[int, str]
 
 class ParseResponse(BaseModel):
     request_id: str
     user_id: str
     product_info: dict
 
-async def get_db_connection():
-    """Создает подключение к БД"""
-    return await asyncpg.connect(**DB_CONFIG)
+async def save_to_db(user_id: Union[int, str], product_info: dict):
+    """Передает результат парсинга фоновому writer, который пишет в parsed_data пакетами"""
+    # Сама запись (db_insert) меряется в BatchWriter, здесь - только постановка в очередь
+    with STAGE_SECONDS.labels("db_enqueue").time():
+        await app.state.db_writer.write(str(user_id), json.dumps(product_info))
+
+def is_complete(product_info: dict) -> bool:
+    """Кэшируем только результаты, где найдены и название, и цена"""
+    return (product_info.get("name") not in (None, "Name not found")
+            and product_info.get("price") not in (None, "Price not found"))
 
-async def save_to_db(conn, user_id: Union[int, str], product_info: dict):
-    query = """
-    INSERT INTO parsed_data (user_id, content, created_at)
-    VALUES ($1, $2, NOW())
+def failure_reason(product_info: dict) -> Optional[str]:
+    """Почему ссылка не распарсилась: ошибка загрузки (http_error / timeout / throttled / error) или что не нашлось"""
+    if is_complete(product_info):
+        return None
+    if product_info.get("error"):
+        return product_info["error"]
+    missing = [field for field, not_found in (("name", "Name not found"), ("price", "Price not found"))
+               if product_info.get(field) in (None, not_found)]
+    return f"{' and '.join(missing)} not found"
+
+async def fetch_product_info(url: str, key: str) -> Tuple[dict, dict]:
+    """Парсит страницу; вместе с результатом отдает время этапов, чтобы его получил каждый ожидающий запрос"""
+    parser = AsyncProductParser(url, app.state.http_client, timeout=HTTP_CLIENT_CONFIG["timeout"],
+                                scheduler=host_scheduler, revalidation=revalidation_cache, cache_key=key,
+                                snapshots=snapshot_store, extractor=app.state.extractor, **FETCH_CONFIG)
+    product_info = await parser.get_product_info()
+    if parser.error:
+        product_info["error"] = parser.error
+    observe_parser(parser, registrable_domain(url))
+    if is_complete(product_info):
+        product_cache.set(key, product_info)
+    return product_info, parser.timing_breakdown()
+
+async def guarded_fetch(url: str, key: str, domain: str) -> Tuple[dict, dict]:
+    """Парсинг с учетом circuit breaker домена: неудачи открывают цепь, успех закрывает"""
+    started = breakers.clock()
+    try:
+        product_info, breakdown = await fetch_product_info(url, key)
+    except Exception as e:
+        breakers.record_failure(domain, str(e), started)
+        raise
+    if product_info.get("error") == "throttled":
+        # Запрос остановил наш собственный лимит на хост, магазин тут ни при чем
+        breakers.release(domain, started)
+    elif is_complete(product_info):
+        breakers.record_success(domain, started)
+    else:
+        breakers.record_failure(domain, "name or price not found", started)
+    return product_info, breakdown
+
+def unsupported_info(error: CircuitOpen) -> dict:
+    return {
+        "name": "Name not found",
+        "price": "Price not found",
+        "price_amount": None,
+        "price_currency": None,
+        "confidence": 0.0,
+        "status": "unsupported",
+        "detail": str(error),
+        "retry_after": round(error.retry_after)
+    }
+
+async def get_product_info(url: str) -> dict:
+    """Возвращает данные о товаре из кэша по канонической ссылке или парсит страницу
+
+    Одновременные запросы одной и той же ссылки ждут один общий парсинг.
+    Если домен раз за разом не парсится, сразу отвечаем status=unsupported.
     """
-    await conn.execute(query, str(user_id), json.dumps(product_info))
+    key = canonical_url(url)
+    domain = registrable_domain(url)
+    product_info = product_cache.get(key)
+    if product_info is not None:
+        OUTCOMES.labels(domain_label(domain), "cached").inc()
+        return product_info
+
+    try:
+        breakers.check(domain)
+    except CircuitOpen as e:
+        logger.info(f"Skipping {url}: {e}")
+        OUTCOMES.labels(domain_label(domain), "unsupported").inc()
+        return unsupported_info(e)
+
+    product_info, breakdown = await inflight.do(key, lambda: guarded_fetch(url, key, domain))
+    # Общий парсинг идет в контексте запроса, который его начал: время этапов каждый записывает себе сам
+    timings = request_timings.get()
+    if timings is not None:
+        timings.update(breakdown)
+    return dict(product_info)
+
+async def process_parse(request: ParseRequest, timings: Optional[dict] = None) -> dict:
+    """Парсит ссылку и сохраняет результат; если передан timings, заполняет его временем фаз"""
+    logger.info(f"Processing URL: {request.url}")
+    started = time.perf_counter()
+    request_timings.set(timings)
+
+    with IN_FLIGHT.track_inprogress():
+        product_info = await get_product_info(request.url)
+
+    response_data = {
+        "request_id": request.request_id or str(uuid.uuid4()),
+        "user_id": request.user_id,
+        "product_info": product_info
+    }
+    print(response_data)
+    print(request)
+    if product_info.get("status") != "unsupported":
+        db_started = time.perf_counter()
+        await save_to_db(request.id, {**product_info, "url": canonical_url(request.url)})
+        if timings is not None:
+            timings["db_enqueue"] = time.perf_counter() - db_started
+
+
+    if timings is not None:
+        timings["total"] = time.perf_counter() - started
+        response_data["timings"] = as_milliseconds(timings)
+    logger.info(f"Successfully parsed: {response_data}")
+    return response_data
+
+async def notify_callback(job) -> int:
+    """Отправляет результат завершенного задания на callback_url, возвращает HTTP-статус ответа"""
+    # Без редиректов: иначе разрешенный хост мог бы перенаправить колбэк во внутреннюю сеть
+    response = await app.state.http_client.post(job.callback_url, json=job.to_dict(), timeout=10,
+                                                follow_redirects=False)
+    return response.status_code
 
 @app.post("/parse")
-async def parse_product(request: ParseRequest):
+async def parse_product(request: ParseRequest, mode: str = "sync", timings: bool = False):
     """Ожидает на вход ссылку на товар, к ней должен прилагаться ID в телеграмме, и ид запроса"""
     """{Пример запроса, с которым роут работает "url": "https://faworldentertainment.com/collections/fa-best-sellers/products/fa-converse-chuck-70","request_id": "1","user_id": "1337"}"""
-    """На выходе получается json вида {"request_id":"1","user_id":"1337","product_info":{"name":"FA Converse Chuck 70","price":"$110"}}"""
-    try:
-        logger.info(f"Processing URL: {request.url}")
-
-        parser = ProductParser(request.url)
-        product_info = parser.get_product_info()
-    
-        response_data = {
-            "request_id": request.request_id or str(uuid.uuid4()),
-            "user_id": request.user_id,
-            "product_info": product_info
-        }
-        print(response_data)
-        print(request)
-        conn = await get_db_connection()
+    """На выходе получается json вида {"request_id":"1","user_id":"1337","product_info":{"name":"FA Converse Chuck 70","price":"$110","price_amount":"110","price_currency":"USD","confidence":0.95}}"""
+    """С ?mode=async сразу возвращается {"job_id": "...", "status": "queued"}, результат - в GET /jobs/{job_id} или POST на callback_url"""
+    """С ?timings=1 (или для доли TIMING_SAMPLE_RATE запросов) в ответе есть заголовок Server-Timing и поле timings в мс"""
+    breakdown = {} if timings or sampled(TIMING_CONFIG["sample_rate"]) else None
+    if mode == "async":
         try:
-            await save_to_db(conn, 
-                  request.id,
-                  response_data["product_info"])
-            
-        finally:
-            await conn.close()
-
+            job = job_queue.submit(lambda: process_parse(request, breakdown), request.callback_url)
+        except CallbackNotAllowed as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except JobQueueFull as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        logger.info(f"Queued job {job.id} for URL: {request.url}")
+        return JSONResponse(status_code=202, content={**job.to_dict(), "status_url": f"/jobs/{job.id}"})
+    if mode != "sync":
+        raise HTTPException(status_code=400, detail="mode must be 'sync' or 'async'")
 
-        logger.info(f"Successfully parsed: {response_data}")
-        return JSONResponse(content=response_data)
+    try:
+        response_data = await process_parse(request, breakdown)
+        headers = {"Server-Timing": server_timing(breakdown)} if breakdown is not None else None
+        return JSONResponse(content=response_data, headers=headers)
 
     except Exception as e:
         logger.error(f"Error processing request: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Статус фонового задания: queued / running / done / failed и результат, если он готов"""
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job.to_dict()
+
+async def parse_batch_item(url: str, db_user_id: Union[int, str]) -> dict:
+    """Парсит одну ссылку из пакета; ошибка не роняет весь пакет"""
+    try:
+        async with batch_limiter.limit(urlsplit(url).hostname):
+            with IN_FLIGHT.track_inprogress():
+                product_info = await get_product_info(url)
+        if product_info.get("status") == "unsupported":
+            return {"url": url, "ok": False, "error": product_info["detail"]}
+        await save_to_db(db_user_id, {**product_info, "url": canonical_url(url)})
+        reason = failure_reason(product_info)
+        if reason:
+            return {"url": url, "ok": False, "error": reason, "product_info": product_info}
+        return {"url": url, "ok": True, "product_info": product_info}
+    except Exception as e:
+        logger.error(f"Error processing batch URL {url}: {e}")
+        return {"url": url, "ok": False, "error": str(e)}
+
+@app.post("/parse/batch")
+async def parse_batch(request: BatchParseRequest):
+    """Пакетный парсинг: список ссылок с ID пользователя, результат по каждой ссылке в исходном порядке"""
+    """{Пример запроса: "urls": ["https://kith.com/products/aaih3432", "https://stockx.com/air-jordan-4-retro-white-thunder"], "user_id": "manager", "id": 1337}"""
+    if not request.urls:
+        raise HTTPException(status_code=400, detail="urls must not be empty")
+    if len(request.urls) > BATCH_CONFIG["max_urls"]:
+        raise HTTPException(status_code=400, detail=f"Too many urls, max {BATCH_CONFIG['max_urls']}")
+
+    logger.info(f"Processing batch of {len(request.urls)} URLs")
+    results = await asyncio.gather(*(parse_batch_item(url, request.id) for url in request.urls))
+    return JSONResponse(content={
+        "request_id": request.request_id or str(uuid.uuid4()),
+        "user_id": request.user_id,
+        "results": results
+    })
+
+@app.get("/stats")
+async def get_stats():
+    """Внутренняя статистика сервиса: пул БД, кэш, объединение запросов, очереди по хостам, соединения и DNS"""
+    return {
+        "db_pool": app.state.db_pool.snapshot(),
+        "db_writer": app.state.db_writer.snapshot(),
+        "product_cache": product_cache.snapshot(),
+        "revalidation": revalidation_cache.snapshot(),
+        "inflight": inflight.snapshot(),
+        "jobs": job_queue.snapshot(),
+        "batch_limiter": batch_limiter.snapshot(),
+        "hosts": host_scheduler.snapshot(),
+        "http": app.state.http_transport.snapshot(),
+        "snapshots": snapshot_store.snapshot() if snapshot_store else None,
+        "extractor": app.state.extractor.snapshot() if app.state.extractor else None
+    }
+
+@app.get("/admin/breakers")
+async def get_breakers():
+    """Состояние circuit breaker по доменам: closed / open / half_open, число неудач подряд, когда будет проба"""
+    return breakers.snapshot()
+
+@app.get("/metrics")
+async def get_metrics():
+    """Метрики Prometheus: время этапов парсинга, исходы по доменам, объем загрузки, запросы в работе, переиспользование соединений"""
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
@@ -0,0 +1,129 @@
+"""Разбор цен: общий модуль для парсера и ботов
+
+Все регулярные выражения компилируются один раз при импорте.
+parse_price возвращает (Decimal, код ISO 4217), extract_display_price - строку цены
+в том виде, в каком ее отдает парсер ("$1,234.56").
+
+user_bot собирается из своего каталога, поэтому в user_bot/ лежит копия
+этого файла. Меняйте их вместе: тест в parser/UnitTest.py сверяет копию.
+"""
+import re
+from decimal import Decimal, InvalidOperation
+
+# Обозначение валюты -> код ISO 4217
+CURRENCY_ALIASES = {
+    "$": "USD", "USD": "USD",
+    "€": "EUR", "EUR": "EUR",
+    "£": "GBP", "GBP": "GBP",
+    "¥": "JPY", "JPY": "JPY",
+    "元": "CNY", "CNY": "CNY",
+    "₹": "INR", "INR": "INR",
+    "₽": "RUB", "RUB": "RUB", "РУБ": "RUB", "РУБ.": "RUB",
+    "CAD": "CAD", "CHF": "CHF",
+}
+
+# Символы валют, по которым парсер ищет цену на странице
+CURRENCY_SYMBOLS = "£$€¥₹"
+
+# Код валюты -> знак для вывода цены
+DISPLAY_SYMBOLS = {"USD": "$", "EUR": "€", "GBP": "£", "JPY": "¥"}
+
+_CURRENCY = "|".join(re.escape(alias) for alias in sorted(CURRENCY_ALIASES, key=len, reverse=True))
+_AMOUNT = r"\d+(?:[ \u00a0\u202f]\d{3})*(?:[.,]\d+)*"
+
+PRICE_PATTERN = re.compile(
+    rf"(?:(?P<pre>{_CURRENCY})\s*)?(?P<amount>{_AMOUNT})(?:\s*(?P<post>{_CURRENCY}))?",
+    re.IGNORECASE
+)
+
+_CURRENCY_SYMBOL = re.compile(f"[{re.escape(CURRENCY_SYMBOLS)}]")
+_NON_PRICE_CHARS = re.compile(rf"[^\d\.,{re.escape(CURRENCY_SYMBOLS)}]")
+# Разделителем тысяч может быть и запятая, и точка: '$1,299.00', '1.299,00€'
+_DISPLAY_AMOUNT = r"\d+(?:[.,]\d{3})*(?:[.,]\d+)?"
+_DISPLAY_PRICE = re.compile(
+    rf"([{re.escape(CURRENCY_SYMBOLS)}]{_DISPLAY_AMOUNT}"
+    rf"|{_DISPLAY_AMOUNT}\s*[{re.escape(CURRENCY_SYMBOLS)}])"
+)
+_SPACES = str.maketrans("", "", " \u00a0\u202f")
+
+
+def currency_code(token):
+    """'$' -> 'USD', 'руб.' -> 'RUB'; None для неизвестных обозначений"""
+    if not token:
+        return None
+    return CURRENCY_ALIASES.get(token.upper())
+
+
+def normalize_amount(text):
+    """Строка суммы в Decimal: '1,299.00', '1.299,00', '19,99', '12 000'
+
+    Если есть и запятая, и точка, десятичный разделитель - последний из них.
+    Одна запятая или точка с тремя цифрами после нее - разделитель тысяч
+    ('1,299', '1.299 €'), с другим числом цифр - десятичная ('19,99', '19.9').
+    Исключение - '0.299': перед разделителем тысяч не бывает нуля.
+    """
+    amount = text.translate(_SPACES)
+    if "," in amount and "." in amount:
+        if amount.rfind(",") > amount.rfind("."):
+            amount = amount.replace(".", "").replace(",", ".")
+        else:
+            amount = amount.replace(",", "")
+    elif "," in amount:
+        if amount.count(",") == 1 and len(amount.rpartition(",")[2]) != 3:
+            amount = amount.replace(",", ".")
+        else:
+            amount = amount.replace(",", "")
+    elif amount.count(".") > 1:
+        amount = amount.replace(".", "")
+    elif "." in amount:
+        whole, _, fraction = amount.partition(".")
+        if len(fraction) == 3 and whole.strip("0"):
+            amount = whole + fraction
+    try:
+        return Decimal(amount)
+    except InvalidOperation:
+        return None
+
+
+def parse_price(text, default_currency=None):
+    """Первая цена в тексте как (Decimal, код валюты) или None
+
+    Совпадение с указанной валютой важнее голого числа: в 'Size 10 - $110'
+    вернется (110, 'USD'). Для числа без валюты используется default_currency.
+    """
+    if not text:
+        return None
+    fallback = None
+    for match in PRICE_PATTERN.finditer(text):
+        amount = normalize_amount(match.group("amount"))
+        if amount is None:
+            continue
+        currency = currency_code(match.group("pre")) or currency_code(match.group("post"))
+        if currency:
+            return amount, currency
+        if fallback is None:
+            fallback = amount
+    if fallback is not None and default_currency:
+        return fallback, default_currency
+    return None
+
+
+def is_price(text):
+    """Весь текст - это цена: '$100', '100 USD', '12000 руб.', '1000'"""
+    return bool(PRICE_PATTERN.fullmatch(text.strip()))
+
+
+def has_currency_symbol(text):
+    return bool(text) and _CURRENCY_SYMBOL.search(text) is not None
+
+
+def extract_display_price(text):
+    """Цена со знаком валюты из текста элемента страницы: 'Price: $ 1,234.56' -> '$1,234.56'"""
+    match = _DISPLAY_PRICE.search(_NON_PRICE_CHARS.sub("", text))
+    return match.group(0).strip() if match else None
+
+
+def format_price(amount, currency):
+    """Цена для вывода: ('110.00', 'USD') -> '$110.00', ('70', 'CAD') -> '70 CAD'"""
+    symbol = DISPLAY_SYMBOLS.get(currency)
+    return f"{symbol}{amount}" if symbol else f"{amount} {currency}"
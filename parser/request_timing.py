@@ -0,0 +1,45 @@
+import random
+import time
+
+
+class RequestTrace:
+    """Колбэк для расширения trace в httpx: время соединения (DNS + TCP + TLS) и до первого байта
+
+    httpcore не выделяет DNS отдельно, он входит в connect_tcp. При редиректах
+    времена складываются по всем запросам цепочки.
+    """
+
+    CONNECT_EVENTS = ('connection.connect_tcp', 'connection.start_tls')
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.connect = 0.0
+        self.ttfb = 0.0
+        self._started = {}
+
+    async def __call__(self, event, info):
+        now = self.clock()
+        name, _, phase = event.rpartition('.')
+        if phase == 'started':
+            self._started[name] = now
+            return
+        if phase != 'complete' or name not in self._started:
+            return
+        if name in self.CONNECT_EVENTS:
+            self.connect += now - self._started.pop(name)
+        elif name.endswith('.receive_response_headers'):
+            request_name = name.replace('receive_response_headers', 'send_request_headers')
+            self.ttfb += now - self._started.get(request_name, self._started[name])
+
+
+def sampled(rate):
+    return rate > 0 and random.random() < rate
+
+
+def server_timing(timings):
+    """{'fetch': 0.1234} -> 'fetch;dur=123.4' для заголовка Server-Timing"""
+    return ', '.join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
+
+
+def as_milliseconds(timings):
+    return {name: round(seconds * 1000, 1) for name, seconds in timings.items()}
@@ -0,0 +1,64 @@
+import time
+
+from product_cache import ProductCache
+
+
+class RevalidationCache:
+    """ETag / Last-Modified уже загруженных страниц вместе с извлеченным product_info
+
+    При повторной загрузке парсер отправляет If-None-Match / If-Modified-Since,
+    и на 304 берет product_info отсюда, не скачивая и не разбирая страницу.
+    Хранится дольше, чем ProductCache: запись нужна как раз после того,
+    как готовый результат там истек.
+    """
+
+    def __init__(self, ttl=86400, max_entries=50000, max_bytes=16 * 1024 * 1024, clock=time.monotonic):
+        self._entries = ProductCache(ttl, max_entries, max_bytes, clock)
+        self.revalidations = 0
+        self.not_modified = 0
+        self.bytes_saved = 0
+        self.parse_seconds_saved = 0.0
+
+    def lookup(self, key):
+        return self._entries.get(key)
+
+    @staticmethod
+    def conditional_headers(entry):
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def store(self, key, response_headers, product_info, body_bytes, parse_seconds):
+        etag = response_headers.get("ETag")
+        last_modified = response_headers.get("Last-Modified")
+        if not etag and not last_modified:
+            return
+        self._entries.set(key, {
+            "etag": etag,
+            "last_modified": last_modified,
+            "product_info": dict(product_info),
+            "body_bytes": body_bytes,
+            "parse_seconds": parse_seconds
+        })
+
+    def record(self, entry, not_modified):
+        """Учитывает ответ на условный запрос: 304 экономит скачивание и разбор страницы"""
+        self.revalidations += 1
+        if not_modified:
+            self.not_modified += 1
+            self.bytes_saved += entry["body_bytes"]
+            self.parse_seconds_saved += entry["parse_seconds"]
+
+    def snapshot(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self._entries.bytes,
+            "revalidations": self.revalidations,
+            "not_modified": self.not_modified,
+            "hit_rate": round(self.not_modified / self.revalidations, 4) if self.revalidations else 0.0,
+            "bytes_saved": self.bytes_saved,
+            "parse_seconds_saved": round(self.parse_seconds_saved, 3)
+        }
@@ -0,0 +1,36 @@
+import asyncio
+
+
+class SingleFlight:
+    """Объединяет одновременные вызовы с одинаковым ключом в один
+
+    Первый вызов запускает задачу, остальные ждут ее же результата (или исключения).
+    Задача защищена от отмены: если отвалится один из ожидающих клиентов,
+    остальные все равно получат результат.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.started = 0
+        self.shared = 0
+
+    def __len__(self):
+        return len(self._calls)
+
+    async def do(self, key, func):
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+            self.started += 1
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def snapshot(self):
+        return {
+            "in_flight": len(self._calls),
+            "started": self.started,
+            "shared": self.shared
+        }
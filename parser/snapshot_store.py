@@ -0,0 +1,198 @@
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MODES = ('off', 'record', 'replay')
+
+# Тело хранится уже распакованным, поэтому эти заголовки при воспроизведении врут
+DROPPED_HEADERS = {'content-encoding', 'content-length', 'transfer-encoding'}
+
+
+class Snapshot:
+    def __init__(self, url, status, headers, body, encoding, fetched_at):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.encoding = encoding
+        self.fetched_at = fetched_at
+
+    @property
+    def text(self):
+        return self.body.decode(self.encoding or 'utf-8', errors='replace')
+
+
+class SnapshotStore:
+    """Локальное хранилище загруженных страниц для воспроизведения парсинга офлайн
+
+    Тела страниц лежат в objects/ под своим sha256 и сжимаются zstd (если установлен
+    zstandard) или gzip, одинаковые страницы хранятся один раз. Для каждой ссылки
+    в urls/ лежит JSON со статусом, заголовками и хэшем тела. Когда общий объем
+    превышает max_bytes, удаляются самые старые записи и тела, на которые
+    больше никто не ссылается.
+    """
+
+    def __init__(self, root, mode='record', max_bytes=512 * 1024 * 1024, compression=None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown snapshot mode {mode!r}, expected one of {', '.join(MODES)}")
+        if compression is None:
+            compression = 'zstd' if zstandard else 'gzip'
+        if compression == 'zstd' and zstandard is None:
+            raise ValueError("zstd compression requires the zstandard package")
+        self.root = root
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.compression = compression
+        self.recorded = 0
+        self.replayed = 0
+        self.replay_misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(root, 'urls'), exist_ok=True)
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        self._records = {}
+        self._objects = {}
+        self._bytes = 0
+        self._load_index()
+
+    @property
+    def recording(self):
+        return self.mode == 'record'
+
+    @property
+    def replaying(self):
+        return self.mode == 'replay'
+
+    @staticmethod
+    def url_key(url):
+        return hashlib.sha256(url.encode()).hexdigest()
+
+    def _record_path(self, key):
+        return os.path.join(self.root, 'urls', f"{key}.json")
+
+    def _object_path(self, name):
+        return os.path.join(self.root, 'objects', name[:2], name)
+
+    def _load_index(self):
+        # Размеры и ссылки считаются один раз при старте, дальше поддерживаются в памяти
+        for name in os.listdir(os.path.join(self.root, 'urls')):
+            path = os.path.join(self.root, 'urls', name)
+            try:
+                with open(path, encoding='utf-8') as f:
+                    record = json.load(f)
+                self._records[name[:-len('.json')]] = (record['object'], os.path.getsize(path), os.path.getmtime(path))
+            except (OSError, ValueError, KeyError):
+                logging.warning(f"Skipping broken snapshot record {path}")
+        objects_dir = os.path.join(self.root, 'objects')
+        for prefix in os.listdir(objects_dir):
+            for name in os.listdir(os.path.join(objects_dir, prefix)):
+                self._objects[name] = os.path.getsize(os.path.join(objects_dir, prefix, name))
+        self._bytes = sum(size for _, size, _ in self._records.values()) + sum(self._objects.values())
+
+    @property
+    def bytes(self):
+        return self._bytes
+
+    def _compress(self, body):
+        if self.compression == 'zstd':
+            return zstandard.ZstdCompressor().compress(body)
+        return gzip.compress(body)
+
+    @staticmethod
+    def _decompress(name, data):
+        if name.endswith('.zst'):
+            if zstandard is None:
+                raise RuntimeError(f"Snapshot {name} needs the zstandard package")
+            return zstandard.ZstdDecompressor().decompress(data)
+        return gzip.decompress(data)
+
+    def save(self, url, status, headers, body, encoding='utf-8'):
+        digest = hashlib.sha256(body).hexdigest()
+        name = f"{digest}.{'zst' if self.compression == 'zstd' else 'gz'}"
+        record = {
+            'url': url,
+            'status': status,
+            'headers': {k.lower(): v for k, v in headers.items() if k.lower() not in DROPPED_HEADERS},
+            'encoding': encoding,
+            'object': name,
+            'fetched_at': time.time()
+        }
+        key = self.url_key(url)
+        with self._lock:
+            if name not in self._objects:
+                path = self._object_path(name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                data = self._compress(body)
+                with open(path, 'wb') as f:
+                    f.write(data)
+                self._objects[name] = len(data)
+                self._bytes += len(data)
+            path = self._record_path(key)
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(record, f, ensure_ascii=False)
+            previous = self._records.get(key)
+            self._records[key] = (name, os.path.getsize(path), time.time())
+            self._bytes += self._records[key][1] - (previous[1] if previous else 0)
+            if previous and previous[0] != name:
+                self._release(previous[0])
+            self.recorded += 1
+            self._evict()
+
+    def load(self, url):
+        """Сохраненный ответ для ссылки или None"""
+        key = self.url_key(url)
+        try:
+            with open(self._record_path(key), encoding='utf-8') as f:
+                record = json.load(f)
+            with open(self._object_path(record['object']), 'rb') as f:
+                body = self._decompress(record['object'], f.read())
+        except (OSError, ValueError, KeyError):
+            self.replay_misses += 1
+            return None
+        self.replayed += 1
+        return Snapshot(record['url'], record['status'], record['headers'], body,
+                        record.get('encoding'), record.get('fetched_at'))
+
+    def _evict(self):
+        if self._bytes <= self.max_bytes:
+            return
+        for key, (name, size, _) in sorted(self._records.items(), key=lambda item: item[1][2]):
+            if self._bytes <= self.max_bytes:
+                break
+            os.remove(self._record_path(key))
+            del self._records[key]
+            self._bytes -= size
+            self.evictions += 1
+            self._release(name)
+
+    def _release(self, name):
+        """Удаляет тело, если на него больше не ссылается ни одна запись; возвращает освобожденный объем"""
+        if any(obj == name for obj, _, _ in self._records.values()):
+            return 0
+        os.remove(self._object_path(name))
+        size = self._objects.pop(name)
+        self._bytes -= size
+        return size
+
+    def snapshot(self):
+        return {
+            "mode": self.mode,
+            "compression": self.compression,
+            "records": len(self._records),
+            "objects": len(self._objects),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "recorded": self.recorded,
+            "replayed": self.replayed,
+            "replay_misses": self.replay_misses,
+            "evictions": self.evictions
+        }
@@ -0,0 +1,103 @@
+from html.parser import HTMLParser
+
+from price_parsing import has_currency_symbol
+from structured_data import extract_structured_data
+
+
+class StreamingDetector(HTMLParser):
+    """Инкрементально читает HTML и сообщает, когда дальше качать страницу незачем
+
+    Уверенность наступает, когда структурированные данные (JSON-LD / мета-теги)
+    уже дали и название, и цену: их обычный разбор найдет и в полученном префиксе.
+
+    heuristic=True дополнительно разрешает остановку, когда закрыт первый тег
+    названия (h1) и встретился span, текст которого - единственный потомок и
+    содержит знак валюты. Это быстрее, но теряет JSON-LD ниже по странице:
+    span корзины "$0.00" в шапке перебьет настоящую цену, поэтому по умолчанию выключено.
+    """
+
+    def __init__(self, name_tag='h1', heuristic=False):
+        super().__init__(convert_charrefs=True)
+        self.name_tag = name_tag
+        self.heuristic = heuristic
+        self.name_found = False
+        self.price_found = False
+        self.json_ld = []
+        self.meta_property = {}
+        self.meta_name = {}
+        self.structured = {}
+        self._name_open = False
+        self._spans = []
+        self._script = None
+        self._structured_dirty = False
+
+    # Интерфейс документа для extract_structured_data
+    def json_ld_texts(self):
+        return self.json_ld
+
+    def meta_content(self, key):
+        if key in self.meta_property:
+            return self.meta_property[key]
+        return self.meta_name.get(key)
+
+    def _child(self, is_text):
+        if self._spans:
+            span = self._spans[-1]
+            if not (is_text and span["last_text"]):
+                span["children"] += 1
+            span["last_text"] = is_text
+
+    def handle_starttag(self, tag, attrs):
+        self._child(False)
+        attrs = dict(attrs)
+        if tag == 'span':
+            self._spans.append({"children": 0, "last_text": False, "text": []})
+        elif tag == self.name_tag and not self.name_found:
+            self._name_open = True
+        elif tag == 'meta':
+            prop, name = attrs.get('property'), attrs.get('name')
+            if prop is not None and prop not in self.meta_property:
+                self.meta_property[prop] = attrs.get('content')
+                self._structured_dirty = True
+            if name is not None and name not in self.meta_name:
+                self.meta_name[name] = attrs.get('content')
+                self._structured_dirty = True
+        elif tag == 'script' and attrs.get('type') == 'application/ld+json':
+            self._script = []
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag == 'span':
+            self._spans.pop()
+
+    def handle_endtag(self, tag):
+        if tag == 'span' and self._spans:
+            span = self._spans.pop()
+            if span["children"] == 1 and span["last_text"] and has_currency_symbol(''.join(span["text"])):
+                self.price_found = True
+        elif tag == self.name_tag and self._name_open:
+            self._name_open = False
+            self.name_found = True
+        elif tag == 'script' and self._script is not None:
+            self.json_ld.append(''.join(self._script))
+            self._script = None
+            self._structured_dirty = True
+
+    def handle_data(self, data):
+        if self._script is not None:
+            self._script.append(data)
+            return
+        self._child(True)
+        if self._spans:
+            self._spans[-1]["text"].append(data)
+
+    def handle_comment(self, data):
+        self._child(False)
+
+    def is_confident(self):
+        if self._structured_dirty:
+            self.structured = extract_structured_data(self)
+            self._structured_dirty = False
+        if self.structured.keys() >= {'name', 'price'}:
+            return True
+        return self.heuristic and self.name_found and self.price_found
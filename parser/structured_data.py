@@ -0,0 +1,102 @@
+import json
+import logging
+
+from price_parsing import format_price
+
+PRODUCT_TYPES = {"Product", "ProductGroup", "IndividualProduct"}
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _iter_json_ld_nodes(data):
+    for node in _as_list(data):
+        if not isinstance(node, dict):
+            continue
+        yield node
+        for child in _as_list(node.get("@graph")):
+            yield from _iter_json_ld_nodes(child)
+
+
+def _is_product(node):
+    return any(t in PRODUCT_TYPES for t in _as_list(node.get("@type")))
+
+
+def _offer_price(offers):
+    for offer in _as_list(offers):
+        if not isinstance(offer, dict):
+            continue
+        amount = offer.get("price", offer.get("lowPrice"))
+        if amount is None and offer.get("priceSpecification"):
+            spec = _as_list(offer["priceSpecification"])[0]
+            amount = spec.get("price") if isinstance(spec, dict) else None
+        if amount in (None, ""):
+            nested = _offer_price(offer.get("offers"))
+            if nested:
+                return nested
+            continue
+        currency = offer.get("priceCurrency", "")
+        return format_price(amount, currency) if currency else str(amount)
+    return None
+
+
+def extract_json_ld(document):
+    """Название и цена из блоков <script type="application/ld+json"> с типом Product"""
+    result = {}
+    for text in document.json_ld_texts():
+        try:
+            data = json.loads(text)
+        except ValueError:
+            logging.debug("Skipping malformed JSON-LD block.")
+            continue
+        for node in _iter_json_ld_nodes(data):
+            if not _is_product(node):
+                continue
+            if not result.get('name') and isinstance(node.get("name"), str) and node["name"].strip():
+                result['name'] = node["name"].strip()
+            if not result.get('price'):
+                price = _offer_price(node.get("offers"))
+                if price is None:
+                    for variant in _as_list(node.get("hasVariant")):
+                        if isinstance(variant, dict):
+                            price = _offer_price(variant.get("offers"))
+                            if price:
+                                break
+                if price:
+                    result['price'] = price
+            if result.get('name') and result.get('price'):
+                return result
+    return result
+
+
+def _meta_content(document, *keys):
+    for key in keys:
+        content = (document.meta_content(key) or "").strip()
+        if content:
+            return content
+    return None
+
+
+def extract_meta_tags(document):
+    """Название и цена из OpenGraph (og:*) и product:price:* мета-тегов"""
+    result = {}
+    name = _meta_content(document, 'og:title')
+    if name:
+        result['name'] = name
+    amount = _meta_content(document, 'product:price:amount', 'og:price:amount')
+    if amount:
+        currency = _meta_content(document, 'product:price:currency', 'og:price:currency')
+        result['price'] = format_price(amount, currency) if currency else amount
+    return result
+
+
+def extract_structured_data(document):
+    """Сначала JSON-LD, недостающие поля добираем из мета-тегов"""
+    result = extract_json_ld(document)
+    if not (result.get('name') and result.get('price')):
+        for key, value in extract_meta_tags(document).items():
+            result.setdefault(key, value)
+    return result
@@ -0,0 +1,91 @@
+import re
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# Параметры аналитики и рекламы, которые не влияют на товар ни на одном сайте
+TRACKING_PARAMS = {"gclid", "fbclid", "yclid", "msclkid", "igshid", "srsltid", "mc_cid", "mc_eid", "_ga", "_gl", "ref"}
+TRACKING_PREFIXES = ("utm_",)
+
+
+class DomainRule:
+    """Правило канонизации ссылок сайта: какие параметры запроса оставить и как упростить путь
+
+    keep=None - оставить все параметры, кроме трекинговых; иначе только перечисленные.
+    """
+
+    def __init__(self, keep=None, path_pattern=None, path_template=None):
+        self.keep = keep
+        self.path_pattern = re.compile(path_pattern) if path_pattern else None
+        self.path_template = path_template
+
+    def path(self, path):
+        if self.path_pattern:
+            match = self.path_pattern.match(path)
+            if match:
+                return match.expand(self.path_template)
+        return path
+
+    def keeps(self, key):
+        return self.keep is None or key in self.keep
+
+
+EBAY_RULE = DomainRule(keep=set(), path_pattern=r"/itm/(?:[^/]+/)?(\d+)", path_template=r"/itm/\1")
+
+# Правила по регистрируемому домену (см. registrable_domain)
+DOMAIN_RULES = {
+    # itmmeta, hash, itmprp, _nkw - поиск и трекинг; товар определяет номер в пути
+    "ebay.com": EBAY_RULE,
+    "ebay.co.uk": EBAY_RULE,
+    "ebay.de": EBAY_RULE,
+    # g_aidx, g_aqid - индекс и id поискового запроса Algolia
+    "grailed.com": DomainRule(keep=set()),
+    # товар задается /prd/<id>, цвет в #colourWayId отбрасывается вместе с фрагментом
+    "asos.com": DomainRule(keep=set()),
+    "stockx.com": DomainRule(keep={"size"}),
+    "farfetch.com": DomainRule(keep={"size"}),
+}
+
+
+def is_tracking_param(key):
+    key = key.lower()
+    return key in TRACKING_PARAMS or key.startswith(TRACKING_PREFIXES)
+
+
+def canonical_url(url, domain_rules=DOMAIN_RULES):
+    """Приводит ссылку к каноническому виду для ключей кэша, объединения запросов и записи в БД
+
+    Схема и хост в нижнем регистре, без www и порта по умолчанию, без фрагмента
+    и трекинговых параметров, оставшиеся параметры отсортированы. Для сайтов
+    из domain_rules оставляются только значимые параметры.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    rule = domain_rules.get(registrable_domain(url)) or DomainRule()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    path = rule.path(parts.path or "/")
+    query = urlencode(sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not is_tracking_param(key) and rule.keeps(key)
+    ))
+    return urlunsplit((scheme, host, path, query, ""))
+
+
+# Публичные суффиксы из двух частей, под которыми встречаются магазины
+MULTI_PART_SUFFIXES = {
+    "co.uk", "org.uk", "com.au", "co.jp", "ne.jp", "com.cn", "com.hk", "co.kr", "com.br", "com.tr", "com.ru",
+}
+
+
+def registrable_domain(url):
+    """Домен, который регистрирует владелец сайта: 'https://m.ebay.co.uk/itm/1' -> 'ebay.co.uk'"""
+    host = (urlsplit(url.strip()).hostname or "").lower().rstrip(".")
+    labels = host.split(".")
+    if len(labels) <= 2 or host.replace(".", "").isdigit():
+        return host
+    size = 3 if ".".join(labels[-2:]) in MULTI_PART_SUFFIXES else 2
+    return ".".join(labels[-size:])
@@ -0,0 +1,77 @@
+import itertools
+import json
+import logging
+import os
+import random
+from urllib.parse import urlsplit
+
+from fake_useragent import UserAgent
+
+FALLBACK_USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.6 Safari/605.1.15",
+]
+
+
+class UserAgentProvider:
+    """Пул User-Agent строк на весь процесс
+
+    Данные fake_useragent загружаются один раз (load() вызывается при старте сервиса
+    или при первом обращении), дальше строки выдаются по кругу из готового пула.
+    domain_weights задает веса типов устройств для отдельных доменов,
+    например {"stockx.com": {"desktop": 3, "mobile": 1}}.
+    """
+
+    def __init__(self, pool_size=50, domain_weights=None):
+        self.pool_size = pool_size
+        self.domain_weights = domain_weights or {}
+        self._by_type = None
+        self._cycle = None
+
+    def load(self):
+        if self._by_type is not None:
+            return
+        by_type = {}
+        try:
+            ua = UserAgent()
+            seen = set()
+            for _ in range(self.pool_size):
+                entry = ua.getRandom
+                if entry["useragent"] not in seen:
+                    seen.add(entry["useragent"])
+                    by_type.setdefault(entry.get("type", "desktop"), []).append(entry["useragent"])
+        except Exception as err:
+            logging.warning(f"Cannot load fake_useragent data, using built-in User-Agents: {err}")
+        if not by_type:
+            by_type = {"desktop": list(FALLBACK_USER_AGENTS)}
+        pool = [agent for agents in by_type.values() for agent in agents]
+        random.shuffle(pool)
+        self._cycle = itertools.cycle(pool)
+        self._by_type = by_type
+
+    def _weights_for(self, url):
+        host = (urlsplit(url).hostname or "").lower()
+        for domain, weights in self.domain_weights.items():
+            if host == domain or host.endswith("." + domain):
+                return weights
+        return None
+
+    def get(self, url=None):
+        self.load()
+        weights = self._weights_for(url) if url else None
+        if weights:
+            types = [t for t in weights if t in self._by_type]
+            if types:
+                device = random.choices(types, weights=[weights[t] for t in types])[0]
+                return random.choice(self._by_type[device])
+        return next(self._cycle)
+
+
+default_provider = UserAgentProvider(
+    pool_size=int(os.getenv("UA_POOL_SIZE", "50")),
+    domain_weights=json.loads(os.getenv("UA_DOMAIN_WEIGHTS", "{}"))
+)
+
+
+def random_user_agent(url=None):
+    return default_provider.get(url)
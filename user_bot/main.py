@@ -5,14 +5,17 @@ import requests
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
 from telegram.ext import Application, CommandHandler, MessageHandler, ContextTypes, filters, ConversationHandler
 from telegram.error import InvalidToken
-import re
 import sys
+from typing import Optional
+from price_parsing import is_price, parse_price
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 API_URL = os.getenv("API_URL")
+# Парсинги дольше этого (мс) логируются с разбивкой по фазам, если парсер прислал timings
+SLOW_PARSE_MS = float(os.getenv("SLOW_PARSE_MS", "5000"))
 
 if not BOT_TOKEN:
     logger.error("BOT_TOKEN is not set in the environment variables")
@@ -72,29 +75,13 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 def is_url(text: str) -> bool:
     return text.startswith("https://")
 
-# Проверка, является ли текст ценой (например, $100, 100 USD, 12000 руб.)
-def is_price(text: str) -> bool:
-    # Примеры: $100, 100 USD, 12000 руб., 1000, 1000 RUB
-    price_pattern = re.compile(r"(\$|€|£|USD|EUR|GBP|CNY|元|руб|RUB)?\s*([\d.,]+)\s*(\$|€|£|USD|EUR|GBP|CNY|元|руб|RUB)?", re.IGNORECASE)
-    return bool(price_pattern.fullmatch(text.strip()))
-
-
 def calculate_price(text: str) -> str:
     """Рассчитать цену в рублях из строки с ценой и валютой, добавить эмодзи валюты."""
-    # Ищем валюту и сумму (например: $100, 100 USD, €50, 12000 RUB)
-    m = re.search(r"(\$|€|¥|£|USD|EUR|GBP|JPY|CNY|元|руб|RUB)?\s*([\d.,]+)\s*(\$|€|¥|£|USD|EUR|GBP|JPY|CNY|元|руб|RUB)?", text.strip(), re.IGNORECASE)
-    if not m:
+    # Ищем валюту и сумму (например: $100, 100 USD, €50, 12000 RUB, 1.299,00 €)
+    parsed = parse_price(text.strip(), default_currency="USD")
+    if not parsed:
         return "Не удалось распознать цену. Попробуйте, например: $100, 100 USD или 1000."
-    cur1, amount_str, cur2 = m.group(1), m.group(2), m.group(3)
-    currency = (cur1 or cur2 or "USD").upper()
-    # Нормализуем русские обозначения рубля
-    if currency in {"РУБ", "RUB"}:
-        currency = "RUB"
-    amount = None
-    try:
-        amount = float(amount_str.replace(",", "."))
-    except ValueError:
-        return "Не удалось распознать сумму. Введите число, например: 99.99"
+    amount, currency = parsed
 
     rates = load_currency_rates()
     # Поддерживаем как коды, так и символы валют
@@ -110,7 +97,7 @@ def calculate_price(text: str) -> str:
         rate = rates.get("USD", 1)
         currency = "USD"
 
-    base_price_rub = amount * rate
+    base_price_rub = float(amount) * rate
     commission_rub = get_commission_rub(base_price_rub)
     rub_price = round(base_price_rub + commission_rub)
 
@@ -295,31 +282,40 @@ async def handle_order_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await update.message.reply_text(f"Ошибка. Попробуйте позже")
                 return ORDER_STATE
             data = response.json()
+            log_slow_parse(text, data.get("timings"))
             product_info = data.get("product_info", {})
+            if product_info.get("status") == "unsupported":
+                await update.message.reply_text(
+                    "Этот сайт сейчас не поддерживается для автоматического расчёта. "
+                    "Отправьте цену вручную (например, $100) или обратитесь к менеджеру."
+                )
+                return ORDER_STATE
+            if product_info.get("error") == "throttled":
+                await update.message.reply_text(
+                    "Сайт магазина сейчас перегружен запросами. Попробуйте через минуту "
+                    "или отправьте цену вручную (например, $100)."
+                )
+                return ORDER_STATE
             name = product_info.get("name", "Неизвестно")
             price = product_info.get("price", "Неизвестно")
             # Конвертация валют с учетом комиссии (теперь используем актуальные курсы)
             CURRENCY_RATES = load_currency_rates()
+            # Сумму и валюту парсер уже разобрал: остается найти курс и умножить
+            amount = product_info.get("price_amount")
+            cur = product_info.get("price_currency") or ""
+            if amount is not None:
+                rate = CURRENCY_RATES.get(cur)
+                if rate:
+                    base_price_rub = float(amount) * rate
+                    commission_rub = get_commission_rub(base_price_rub)
+                    rub_price = round(base_price_rub + commission_rub)
+                    price = f"≈ {rub_price} ₽"
+                    cur = ""
+                else:
+                    logger.warning(f"Нет курса для цены: {price}")
+            # Покажем эмодзи валюты, если цену не удалось пересчитать
             if isinstance(price, str):
-                match = re.search(r"(€|\$|£|USD|EUR|GBP|CNY|元)\s*([\d.,]+)", price.upper())
-                if match:
-                    currency = match.group(1)
-                    amount_str = match.group(2).replace(",", ".")
-                    try:
-                        amount = float(amount_str)
-                        rate = CURRENCY_RATES.get(currency)
-                        if rate:
-                            base_price_rub = amount * rate
-                            commission_rub = get_commission_rub(base_price_rub)
-                            rub_price = round(base_price_rub + commission_rub)
-                            price = f"≈ {rub_price} ₽"
-                    except ValueError:
-                        logger.warning(f"Не удалось разобрать цену: {price}")
-            # Покажем эмодзи валюты, если распознали
-            if isinstance(price, str):
-                m = re.search(r"(€|\$|£|USD|EUR|GBP|CNY|元)", price.upper())
-                cur = m.group(1) if m else ""
-                emoji_map = {"USD":"💵","EUR":"💶","GBP":"💷","CNY":"🧧","$":"💵","€":"💶","£":"💷","元":"🧧"}
+                emoji_map = {"USD":"💵","EUR":"💶","GBP":"💷","CNY":"🧧"}
                 emoji = emoji_map.get(cur, "")
                 price = f"{price} {emoji}".strip()
             await update.message.reply_text(
@@ -346,6 +342,14 @@ async def handle_order_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Пожалуйста, отправьте ссылку на товар или цену (например, $100, 100 USD, 12000 руб.), либо нажмите 🔙 В меню.")
     return ORDER_STATE
 
+def log_slow_parse(url: str, timings: Optional[dict]) -> None:
+    """Логирует медленный парсинг вместе с самой долгой фазой (connect, ttfb, download, parse, db)"""
+    if not timings or timings.get("total", 0) < SLOW_PARSE_MS:
+        return
+    phases = {name: ms for name, ms in timings.items() if name != "total"}
+    slowest = max(phases, key=phases.get) if phases else "unknown"
+    logger.warning(f"Медленный парсинг {url}: {timings['total']} мс, дольше всего {slowest}. Фазы: {timings}")
+
 def get_commission_rub(base_price_rub: float) -> float:
     """Рассчитывает комиссию в рублях в зависимости от базовой цены товара."""
     if base_price_rub <= 7000: